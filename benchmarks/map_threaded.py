@@ -0,0 +1,47 @@
+''' Benchmark Route.map_threaded scaling with the number of threads.
+
+Usage, from a source checkout or with routely installed: python benchmarks/map_threaded.py [nr_routes] [nr_points]
+
+Thread scaling needs as many CPU cores as threads, the core count is printed with the results.
+'''
+
+import os
+import sys
+import time
+
+import numpy as np
+
+# run against the source checkout this script belongs to
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from routely import Route
+
+
+def _pipeline(r):
+    r = r.clean_coordinates()
+    r = r.rotate(30).mirror(about_x=True)
+    r = r.interpolate(kind='absolute_steps', num=r.nr_points())
+    return r.center_on_origin()
+
+
+def main(nr_routes=64, nr_points=200000):
+    rng = np.random.default_rng(0)
+    routes = [Route(np.cumsum(rng.normal(size=nr_points)), np.cumsum(rng.normal(size=nr_points)))
+              for _ in range(nr_routes)]
+
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print(f'Python {sys.version.split()[0]}, GIL enabled: {gil}, CPU cores: {os.cpu_count()}')
+    print(f'{nr_routes} routes of {nr_points} points')
+
+    base = None
+    for workers in [1, 2, 4, 8, 16]:
+        start = time.perf_counter()
+        Route.map_threaded(_pipeline, routes, workers=workers)
+        elapsed = time.perf_counter() - start
+
+        base = base or elapsed
+        print(f'{workers:>2} threads: {elapsed:.3f} s, speedup {base/elapsed:.2f}x')
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -1 +1,3 @@
-from .routely import Route
\ No newline at end of file
+from .routely import Route
+from .index import RouteIndex
+from .filters import KalmanFilter
@@ -0,0 +1,209 @@
+''' Routely arc length '''
+
+import numpy as np
+
+from scipy.interpolate import PPoly, make_interp_spline
+
+
+class ArcLength:
+    """
+    Arc length parameterisation of a smooth parametric curve (x(t), y(t)) given by cubic splines, as fitted by Route.smooth().
+
+    The curve length is the integral of its speed, sqrt(x'(t)**2 + y'(t)**2), integrated with Gauss-Legendre quadrature over many intervals at once. Starting from the intervals between the spline knots, every interval whose integral differs from the sum over its two halves by more than the tolerance is split, and this is repeated until all intervals are within tolerance, so intervals are short only where the speed changes quickly, such as tight turns. The cumulative lengths at the interval breakpoints form a table that is inverted with Newton's method, safeguarded by bisection within the bracketing interval, to find the parameter at any arc length.
+
+    Args:
+        t (array) : 1d array of increasing spline knots, such as the route distance the splines were fitted against.
+
+        x (array) : 1d array of x-coordinates at the knots.
+
+        y (array) : 1d array of y-coordinates at the knots.
+
+        order (int, optional) : Number of Gauss-Legendre nodes per interval. Defaults to 8.
+
+        tol (float, optional) : Length tolerance relative to the total length. Defaults to 1e-10.
+
+        max_depth (int, optional) : Maximum number of times an interval between knots is split in half. Defaults to 30.
+    """
+
+    def __init__(self, t, x, y, order=8, tol=1e-10, max_depth=30):
+
+        t = np.asarray(t, dtype=float)
+        if np.any(np.diff(t) <= 0):
+            raise ValueError("Spline knots 't' must be strictly increasing")
+
+        self.fx = make_interp_spline(t, np.asarray(x, dtype=float), k=3)
+        self.fy = make_interp_spline(t, np.asarray(y, dtype=float), k=3)
+
+        # derivatives as piecewise polynomials, evaluated directly on a known polynomial piece
+        self._dx = PPoly.from_spline(self.fx).derivative()
+        self._dy = PPoly.from_spline(self.fy).derivative()
+        breaks = self._dx.x
+
+        self._nodes, self._weights = np.polynomial.legendre.leggauss(order)
+
+        # split intervals until each is integrated within its share of the tolerance, starting from the polynomial pieces
+        piece = np.flatnonzero(np.diff(breaks) > 0)
+        a, b = breaks[piece], breaks[piece + 1]
+        whole = self._integrate(a, b, piece)
+        abs_tol = tol*max(whole.sum(), np.finfo(float).tiny)/(t[-1] - t[0])
+
+        table = []
+        for depth in range(max_depth):
+            m = (a + b)/2.
+            left, right = self._integrate(a, m, piece), self._integrate(m, b, piece)
+            split = np.abs(left + right - whole) > abs_tol*(b - a)
+            if depth == max_depth - 1:
+                split[:] = False
+
+            # accepted intervals enter the table as their two more accurate halves
+            done = ~split
+            table.append((np.r_[a[done], m[done]], np.r_[left[done], right[done]], np.r_[piece[done], piece[done]]))
+
+            a, b, m, piece = a[split], b[split], m[split], piece[split]
+            a, b, whole, piece = np.r_[a, m], np.r_[m, b], np.r_[left[split], right[split]], np.r_[piece, piece]
+            if not len(a):
+                break
+
+        starts, lengths, pieces = (np.concatenate(v) for v in zip(*table))
+        order = np.argsort(starts)
+        self.t_table = np.r_[starts[order], t[-1]]
+        self.s_table = np.r_[0., np.cumsum(lengths[order])]
+        self._pieces = pieces[order]
+
+
+    def speed(self, t):
+        """Get the speed of the curve, the derivative of arc length with respect to t.
+
+        Args:
+            t (array): curve parameter values.
+
+        Returns:
+            array: speed at each parameter value.
+        """
+        return np.hypot(self._dx(t), self._dy(t))
+
+
+    def _speed(self, t, piece):
+        """Get the speed at parameter values t, where piece gives the polynomial piece of each row of t.
+        """
+        u = t - self._dx.x[piece].reshape(piece.shape + (1,)*(t.ndim - piece.ndim))
+
+        def horner(c):
+            c = c[:, piece].reshape(c.shape[:1] + piece.shape + (1,)*(t.ndim - piece.ndim))
+            value = c[0]
+            for ci in c[1:]:
+                value = value*u + ci
+            return value
+
+        return np.hypot(horner(self._dx.c), horner(self._dy.c))
+
+
+    def _integrate(self, a, b, piece, block_size=4096):
+        """Integrate the speed from a to b elementwise with Gauss-Legendre quadrature, where each interval lies within the given polynomial piece. Intervals are evaluated in blocks to bound the memory used by the quadrature nodes.
+        """
+        out = np.empty(len(a))
+        for start in range(0, len(a), block_size):
+            sl = slice(start, start + block_size)
+            half = (b[sl] - a[sl])/2.
+            t = ((a[sl] + b[sl])/2.)[:, None] + half[:, None]*self._nodes[None, :]
+            out[sl] = half*(self._speed(t, piece[sl]) @ self._weights)
+        return out
+
+
+    def length(self):
+        """Get the total length of the curve.
+
+        Returns:
+            float: curve length.
+        """
+        return self.s_table[-1]
+
+
+    def s(self, t):
+        """Get the arc length from the start of the curve to parameter values t.
+
+        Args:
+            t (array): curve parameter values.
+
+        Returns:
+            array: arc length at each parameter value.
+        """
+        t = np.clip(np.asarray(t, dtype=float), self.t_table[0], self.t_table[-1])
+        i = np.clip(np.searchsorted(self.t_table, t, side='right') - 1, 0, len(self.t_table) - 2)
+        return self.s_table[i] + self._integrate(self.t_table[i], t, self._pieces[i])
+
+
+    def t(self, s, tol=1e-12, max_iter=50):
+        """Get the parameter values at arc lengths s, inverting the length table.
+
+        Args:
+            s (array): arc lengths from the start of the curve.
+            tol (float, optional): arc length tolerance relative to the total length. Defaults to 1e-12.
+            max_iter (int, optional): maximum number of Newton iterations. Defaults to 50.
+
+        Returns:
+            array: curve parameter values.
+        """
+        s = np.clip(np.asarray(s, dtype=float), 0, self.length())
+        tol = tol*max(self.length(), 1.)
+        i = np.clip(np.searchsorted(self.s_table, s, side='right') - 1, 0, len(self.t_table) - 2)
+
+        # bracket within the table interval, starting from a linear guess
+        lo, hi = self.t_table[i], self.t_table[i + 1]
+        s_lo, s_hi = self.s_table[i], self.s_table[i + 1]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            frac = np.where(s_hi > s_lo, (s - s_lo)/(s_hi - s_lo), 0.)
+        t = lo + frac*(hi - lo)
+
+        active = np.ones(len(s), dtype=bool)
+        for _ in range(max_iter):
+            err = s_lo[active] + self._integrate(self.t_table[i[active]], t[active], self._pieces[i[active]]) - s[active]
+
+            done = np.abs(err) <= tol
+            too_long = err > 0
+            hi[active] = np.where(too_long, t[active], hi[active])
+            lo[active] = np.where(too_long, lo[active], t[active])
+
+            # Newton step, falling back to bisection when it leaves the bracket
+            with np.errstate(invalid='ignore', divide='ignore'):
+                step = t[active] - err/self._speed(t[active], self._pieces[i[active]])
+            inside = (step > lo[active]) & (step < hi[active])
+            t[active] = np.where(done, t[active], np.where(inside, step, (lo[active] + hi[active])/2.))
+
+            active[np.flatnonzero(active)[done]] = False
+            if not active.any():
+                break
+
+        return t
+
+
+    def resample(self, num=None, spacing=None):
+        """Get parameter values at equal arc length spacing along the curve, including both ends.
+
+        Args:
+            num (int, optional): number of points, spaced equally from start to end.
+            spacing (float, optional): arc length between points, starting from the start of the curve. The end of the curve is added if it does not fall on a step.
+
+        Returns:
+            array: curve parameter values.
+        """
+        if (num is None) == (spacing is None):
+            raise ValueError("Exactly one of 'num' or 'spacing' must be given")
+
+        length = self.length()
+        if num is not None:
+            if num < 2:
+                raise ValueError("'num' must be at least 2")
+            s = np.linspace(0, length, num)
+        else:
+            if not spacing > 0:
+                raise ValueError("'spacing' must be greater than 0")
+            s = np.arange(0, length, spacing)
+            # a last step that falls on the end up to rounding is replaced by the end
+            if len(s) > 1 and length - s[-1] <= 1e-9*length:
+                s = s[:-1]
+            s = np.r_[s, length]
+
+        t = self.t(s)
+        t[[0, -1]] = self.t_table[[0, -1]]
+        return t
@@ -0,0 +1,356 @@
+''' Routely cache '''
+
+import copy
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import tempfile
+import threading
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+# The active cache used by memoized Route methods, None when caching is off
+_active = None
+
+
+def content_hash(route):
+    """Get a stable hash of a Route's content, over the bytes, dtype and shape of x, y and each z array along with the z keys. Distance is derived from x and y so is not included. Equal routes give equal hashes across processes and machines with the same byte order.
+
+    Args:
+        route (Route): the route to hash.
+
+    Returns:
+        str: hex digest.
+    """
+    h = hashlib.blake2b(digest_size=20)
+
+    def update(name, values):
+        values = np.ascontiguousarray(values)
+        h.update(repr((name, values.dtype.str, values.shape)).encode('utf-8'))
+        h.update(values.data)
+
+    update('x', route.x)
+    update('y', route.y)
+    if route.z is not None:
+        for k, v in route.z.items():
+            update(('z', k), v)
+
+    return h.hexdigest()
+
+
+def _nbytes(value):
+    """Estimate the memory held by a cached value.
+    """
+    if hasattr(value, 'x') and hasattr(value, 'y') and hasattr(value, 'd'):
+        z = value.z.values() if value.z is not None else []
+        return sum(np.asarray(v).nbytes for v in [value.x, value.y, value.d, *z])
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class MemoryBackend:
+    """
+    In-memory least recently used store, bounded by the total size of its values. Values are copied in and out, so changes made by one caller to a cached result do not reach later callers.
+
+    Args:
+        max_bytes (int, optional) : Maximum total size of stored values. Defaults to 256 MB.
+    """
+
+    def __init__(self, max_bytes=256*2**20):
+
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+
+    def get(self, key):
+        """Get a stored value, raising KeyError if it is not stored.
+        """
+        with self._lock:
+            value, _ = self._items[key]
+            self._items.move_to_end(key)
+
+        return copy.deepcopy(value)
+
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used values as needed. Values larger than max_bytes are not stored.
+        """
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return
+
+        value = copy.deepcopy(value)
+        with self._lock:
+            if key in self._items:
+                self._size -= self._items.pop(key)[1]
+            self._items[key] = (value, size)
+            self._size += size
+
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self._size -= evicted
+
+
+    def clear(self):
+        """Remove all stored values.
+        """
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+
+
+    def nbytes(self):
+        """Get the total size of stored values.
+        """
+        return self._size
+
+
+class DiskBackend:
+    """
+    On-disk least recently used store in a directory, which can be shared by several worker processes. Values are pickled to one file per key, written atomically, and the least recently used files are removed when the directory grows beyond max_bytes. The directory size is tracked from the files written, and is only rescanned when that estimate goes over max_bytes or every rescan_interval writes, to pick up files written by other processes.
+
+    Args:
+        directory (str) : Directory for the cache files. Created if it does not exist.
+
+        max_bytes (int, optional) : Maximum total size of the cache files. Defaults to 1 GB.
+    """
+
+    _suffix = '.pkl'
+    rescan_interval = 64
+
+    def __init__(self, directory, max_bytes=2**30):
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        # estimated total size of the cache files, None until scanned
+        self._size = None
+        self._writes = 0
+
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self._suffix)
+
+
+    def get(self, key):
+        """Get a stored value, raising KeyError if it is not stored.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            raise KeyError(key) from None
+        except (pickle.UnpicklingError, EOFError):
+            # treat a damaged file as missing
+            self._remove(path)
+            raise KeyError(key) from None
+
+        # modification time orders files for eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+        return value
+
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used files as needed.
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                size = f.tell()
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            self._remove(tmp)
+            raise
+
+        # a replaced file is counted twice, which only brings the next scan forward
+        self._writes += 1
+        if self._size is not None and self._writes < self.rescan_interval:
+            self._size += size
+            if self._size <= self.max_bytes:
+                return
+        self._evict()
+
+
+    def _entries(self):
+        """Get (mtime, size, path) of every cache file.
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self._suffix):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(e[1] for e in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+        self._size = total
+        self._writes = 0
+
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+    def clear(self):
+        """Remove all stored values.
+        """
+        for _, _, path in self._entries():
+            self._remove(path)
+        self._size = None
+
+
+    def nbytes(self):
+        """Get the total size of the cache files.
+        """
+        return sum(e[1] for e in self._entries())
+
+
+class RouteCache:
+    """
+    Memoization cache for Route methods, keyed by the Route content hash, the method name and its arguments. Keeps hit and miss statistics.
+
+    Args:
+        backend (MemoryBackend or DiskBackend, optional) : Store for cached results. Defaults to a MemoryBackend.
+    """
+
+    def __init__(self, backend=None):
+
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.hits = 0
+        self.misses = 0
+
+
+    @staticmethod
+    def key(route, method, arguments):
+        """Get the cache key for a method call on a route.
+
+        Args:
+            route (Route): the route.
+            method (str): method name.
+            arguments (dict): the call arguments, including defaults.
+
+        Returns:
+            str: hex digest.
+        """
+        h = hashlib.blake2b(digest_size=20)
+        h.update(route.content_hash().encode('utf-8'))
+        h.update(repr((method, sorted(arguments.items()))).encode('utf-8'))
+        return h.hexdigest()
+
+
+    def get_or_call(self, route, method, arguments, fn):
+        """Get a cached result, or call fn and cache its result.
+        """
+        key = self.key(route, method, arguments)
+        try:
+            value = self.backend.get(key)
+        except KeyError:
+            self.misses += 1
+            value = fn()
+            self.backend.set(key, value)
+        else:
+            self.hits += 1
+        return value
+
+
+    def stats(self):
+        """Get cache statistics.
+
+        Returns:
+            dict: hits, misses, hit_rate and nbytes held by the backend.
+        """
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits/total if total else 0.,
+            'nbytes': self.backend.nbytes(),
+        }
+
+
+    def clear(self):
+        """Remove all cached results and reset statistics.
+        """
+        self.backend.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+def enable_cache(backend=None):
+    """Turn on memoization of the expensive Route methods (interpolate, smooth and optimise_bbox).
+
+    Args:
+        backend (MemoryBackend or DiskBackend, optional): Store for cached results. Defaults to a MemoryBackend.
+
+    Returns:
+        RouteCache: the active cache.
+    """
+    global _active
+    _active = RouteCache(backend)
+    return _active
+
+
+def disable_cache():
+    """Turn off memoization of Route methods.
+    """
+    global _active
+    _active = None
+
+
+def get_cache():
+    """Get the active cache.
+
+    Returns:
+        RouteCache: the active cache, or None if caching is off.
+    """
+    return _active
+
+
+def memoized(method):
+    """Decorate a Route method so that its results are cached while a cache is enabled. Arguments are bound to the method signature, including defaults, so equivalent calls share a cache entry.
+    """
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        cache = _active
+        if cache is None:
+            return method(self, *args, **kwargs)
+
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        del arguments['self']
+
+        return cache.get_or_call(self, method.__name__, arguments, lambda: method(self, *args, **kwargs))
+
+    return wrapper
@@ -0,0 +1,397 @@
+''' Routely chunked processing '''
+
+import json
+import math
+import os
+import tempfile
+
+import numpy as np
+
+from .lod import significance
+from .routely import Route
+
+
+_META = 'route.json'
+
+# Fixed size of the .npy header written by _NpyWriter, so it can be rewritten once the length is known
+_NPY_PREFIX = 128
+
+
+class _NpyWriter:
+    """
+    Write a 1d .npy file incrementally without knowing its final length. The header is written with a fixed size and rewritten with the final length on close. Data is written to a temporary file that replaces path on close, so an interrupted write never leaves a truncated file at path.
+    """
+
+    def __init__(self, path, dtype):
+
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        fd, self._tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        self._f = os.fdopen(fd, 'wb')
+        self._write_header()
+
+
+    def _write_header(self):
+        header = repr({'descr': np.lib.format.dtype_to_descr(self.dtype), 'fortran_order': False, 'shape': (self.length,)})
+        header = header.encode('latin1').ljust(_NPY_PREFIX - 10 - 1) + b'\n'
+        self._f.seek(0)
+        self._f.write(b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') + header)
+
+
+    def append(self, values):
+        values = np.ascontiguousarray(values, dtype=self.dtype)
+        self._f.seek(0, os.SEEK_END)
+        self._f.write(values.tobytes())
+        self.length += len(values)
+
+
+    def close(self):
+        self._write_header()
+        self._f.close()
+        os.replace(self._tmp, self.path)
+
+
+    def abort(self):
+        """Discard the file without writing it to path.
+        """
+        self._f.close()
+        os.remove(self._tmp)
+
+
+class ChunkedRouteWriter:
+    """
+    Write a ChunkedRoute to a directory incrementally, one chunk of points at a time. Use as a context manager, or call close() when done.
+
+    Args:
+        directory (str) : Directory for the route files. Created if it does not exist.
+
+        z_keys (list, optional) : Keys of the z data that will be appended. Defaults to None.
+
+        dtype (dtype, optional) : dtype of the stored data. Defaults to float.
+    """
+
+    def __init__(self, directory, z_keys=None, dtype=float):
+
+        self._created = not os.path.isdir(directory)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.z_keys = list(z_keys) if z_keys is not None else None
+
+        self._files = {'x': 'x.npy', 'y': 'y.npy', 'z': [f'z_{i}.npy' for i in range(len(self.z_keys or []))]}
+        self._x = _NpyWriter(os.path.join(directory, self._files['x']), dtype)
+        self._y = _NpyWriter(os.path.join(directory, self._files['y']), dtype)
+        self._z = [_NpyWriter(os.path.join(directory, f), dtype) for f in self._files['z']]
+
+
+    def append(self, x, y, z=None):
+        """Append a chunk of points.
+
+        Args:
+            x (array-like): x-coordinates.
+            y (array-like): y-coordinates.
+            z (dict, optional): z data, with the keys given when the writer was created. Defaults to None.
+        """
+        if len(x) != len(y):
+            raise ValueError("Route inputs 'x' and 'y' must be of equal length")
+
+        self._x.append(x)
+        self._y.append(y)
+        for k, w in zip(self.z_keys or [], self._z):
+            if len(z[k]) != len(x):
+                raise ValueError("Route input 'z' must be of equal length to 'x' and 'y'")
+            w.append(z[k])
+
+
+    def close(self):
+        """Finish writing the route files. The data files are moved into place before the metadata, so an existing route in the directory is replaced only once the new data is complete.
+        """
+        # a previously calculated distance no longer applies
+        path = os.path.join(self.directory, 'd.npy')
+        if os.path.exists(path):
+            os.remove(path)
+
+        for w in [self._x, self._y, *self._z]:
+            w.close()
+
+        fd, tmp = tempfile.mkstemp(dir=os.path.abspath(self.directory), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'z_keys': self.z_keys, 'files': self._files}, f)
+            os.replace(tmp, os.path.join(self.directory, _META))
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+
+    def abort(self):
+        """Discard the route files written so far, leaving the directory as it was.
+        """
+        for w in [self._x, self._y, *self._z]:
+            w.abort()
+
+        if self._created:
+            os.rmdir(self.directory)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class ChunkedRoute:
+    """
+    A route stored on disk and processed in fixed-size chunks of points, for routes too large to hold in memory. The route's x, y and z data are .npy files in a directory, memory-mapped and read one chunk at a time, so peak memory is bounded by the chunk size rather than the route size. Operations that produce a new route write it to another directory as they go.
+
+    Consecutive chunks overlap by one point, so that segments spanning a chunk boundary are handled correctly, and running totals such as distance are carried from one chunk to the next.
+
+    Args:
+        directory (str) : Directory of the route files, as written by ChunkedRouteWriter.
+
+        chunk_size (int, optional) : Number of points processed at a time. Defaults to 1000000.
+    """
+
+    def __init__(self, directory, chunk_size=1000000):
+
+        if chunk_size < 2:
+            raise ValueError("'chunk_size' must be at least 2")
+
+        self.directory = directory
+        self.chunk_size = int(chunk_size)
+
+        with open(os.path.join(directory, _META)) as f:
+            meta = json.load(f)
+
+        self.z_keys = meta['z_keys']
+        self.x = self._open(meta['files']['x'])
+        self.y = self._open(meta['files']['y'])
+        self.z = {k: self._open(f) for k, f in zip(self.z_keys, meta['files']['z'])} if self.z_keys is not None else None
+
+        if len(self.x) < 2:
+            raise ValueError("Route input 'x' must contain more than 1 item")
+
+
+    def _open(self, name):
+        return np.load(os.path.join(self.directory, name), mmap_mode='r')
+
+
+    @staticmethod
+    def writer(directory, z_keys=None, dtype=float):
+        """Create a ChunkedRouteWriter. See ChunkedRouteWriter.
+        """
+        return ChunkedRouteWriter(directory, z_keys=z_keys, dtype=dtype)
+
+
+    @classmethod
+    def from_route(cls, route, directory, chunk_size=1000000):
+        """Write an in-memory Route to a directory as a ChunkedRoute.
+
+        Args:
+            route (Route): the route.
+            directory (str): directory for the route files.
+            chunk_size (int, optional): Number of points processed at a time. Defaults to 1000000.
+
+        Returns:
+            ChunkedRoute: Return a new ChunkedRoute object.
+        """
+        keys = list(route.z.keys()) if route.z is not None else None
+        with ChunkedRouteWriter(directory, z_keys=keys) as w:
+            w.append(route.x, route.y, route.z)
+
+        return cls(directory, chunk_size=chunk_size)
+
+
+    def to_route(self):
+        """Load the whole route into memory as a Route.
+
+        Returns:
+            Route: Return a new Route object.
+        """
+        zz = {k: np.array(v) for k, v in self.z.items()} if self.z is not None else None
+        return Route(np.array(self.x), np.array(self.y), z=zz)
+
+
+    def nr_points(self):
+        """Get the number of coordinate points that comprise the route.
+
+        Returns:
+            int: number of coordinates.
+        """
+        return len(self.x)
+
+
+    def nr_chunks(self):
+        """Get the number of chunks the route is processed in.
+
+        Returns:
+            int: number of chunks.
+        """
+        return math.ceil((len(self.x) - 1)/(self.chunk_size - 1))
+
+
+    def chunks(self, with_distance=False):
+        """Iterate over the route in chunks of points. Each chunk starts with the last point of the previous chunk.
+
+        Args:
+            with_distance (bool, optional): If True, include the cumulative distance of each point, calculating it first if needed. Defaults to False.
+
+        Yields:
+            tuple: (x, y, z, d) arrays of the chunk, where z is a dict or None, and d is None unless with_distance.
+        """
+        d = self.distance() if with_distance else None
+        n = len(self.x)
+        step = self.chunk_size - 1
+
+        for start in range(0, n - 1, step):
+            sl = np.s_[start:min(start + self.chunk_size, n)]
+            zz = {k: np.asarray(v[sl]) for k, v in self.z.items()} if self.z is not None else None
+            yield (np.asarray(self.x[sl]), np.asarray(self.y[sl]), zz, np.asarray(d[sl]) if d is not None else None)
+
+
+    def distance(self):
+        """Get the cumulative distance along the route, calculated chunk by chunk and stored as d.npy alongside the route files. The result is memory-mapped.
+
+        Returns:
+            array: 1d array of cumulative distance from the start of the route to the end.
+        """
+        path = os.path.join(self.directory, 'd.npy')
+        if not os.path.exists(path):
+            w = _NpyWriter(path, float)
+            try:
+                offset = 0.
+                w.append([0.])
+                for x, y, _, _ in self.chunks():
+                    dist = offset + np.cumsum(np.hypot(np.diff(x), np.diff(y)))
+                    w.append(dist)
+                    offset = dist[-1]
+            except BaseException:
+                w.abort()
+                raise
+            w.close()
+
+        return np.load(path, mmap_mode='r')
+
+
+    def bbox(self):
+        """Get the bounding box coordinates of the route.
+
+        Returns:
+            tuple: (lower-left corner coordinates, upper-right corner coordinates).
+        """
+        lower = [np.inf, np.inf]
+        upper = [-np.inf, -np.inf]
+        for x, y, _, _ in self.chunks():
+            lower = [min(lower[0], x.min()), min(lower[1], y.min())]
+            upper = [max(upper[0], x.max()), max(upper[1], y.max())]
+
+        return (tuple(lower), tuple(upper))
+
+
+    def _write(self, directory, chunks):
+        """Write (x, y, z) chunks to a new ChunkedRoute.
+        """
+        with ChunkedRouteWriter(directory, z_keys=self.z_keys) as w:
+            for x, y, zz in chunks:
+                w.append(x, y, zz)
+
+        return ChunkedRoute(directory, chunk_size=self.chunk_size)
+
+
+    def clean_coordinates(self, directory):
+        """Remove consecutive duplicate x and y coordinates, keeping the first, as Route.clean_coordinates(duplicates='consecutive'). Removing all duplicates ('any') needs the whole route and is not available for chunked routes.
+
+        Args:
+            directory (str): directory for the new route files.
+
+        Returns:
+            ChunkedRoute: Return a new ChunkedRoute object.
+        """
+        def cleaned():
+            for i, (x, y, zz, _) in enumerate(self.chunks()):
+                keep = np.r_[True, (np.diff(x) != 0) | (np.diff(y) != 0)]
+
+                # the first point of each later chunk was handled by the previous chunk
+                if i > 0:
+                    keep[0] = False
+
+                yield x[keep], y[keep], ({k: v[keep] for k, v in zz.items()} if zz is not None else None)
+
+        return self._write(directory, cleaned())
+
+
+    def interpolate(self, directory, kind='equidistant_steps', num=1):
+        """Interpolate the route as Route.interpolate(), one chunk at a time.
+
+        Args:
+            directory (str): directory for the new route files.
+            kind (str, optional): 'equidistant_steps' or 'absolute_steps', see Route.interpolate(). Defaults to 'equidistant_steps'.
+            num (int, optional): step value corresponding to chosen 'kind' of interpolation. Defaults to 1.
+
+        Returns:
+            ChunkedRoute: Return a new ChunkedRoute object.
+        """
+        if not (kind == 'equidistant_steps') | (kind == 'absolute_steps'):
+            raise ValueError("Keyword argument for 'kind' not recognised. See docs for options.")
+
+        d = self.distance()
+        d_max = float(d[-1])
+
+        if kind == 'equidistant_steps':
+            step = num
+            # length of np.arange(0, d_max + num, num), without creating it
+            nr_steps = max(int(math.ceil((d_max + num)/num)), 0)
+        else:
+            step = d_max/(num - 1) if num > 1 else 0.
+            nr_steps = num
+
+        nr_chunks = self.nr_chunks()
+
+        def interpolated():
+            k = 0
+            for i, (x, y, zz, dd) in enumerate(self.chunks(with_distance=True)):
+
+                # grid points up to the end of this chunk, the final chunk takes any beyond the end of the route
+                if i == nr_chunks - 1 or step == 0:
+                    k_end = nr_steps
+                else:
+                    k_end = min(int(math.floor(dd[-1]/step)) + 1, nr_steps)
+
+                # long segments can hold many grid points, so write them at most a chunk at a time
+                while k < k_end:
+                    k_next = min(k + self.chunk_size, k_end)
+                    dist = np.arange(k, k_next)*step
+                    if kind == 'absolute_steps' and num > 1 and k_next == nr_steps:
+                        dist[-1] = d_max
+                    k = k_next
+
+                    yield (np.interp(dist, dd, x), np.interp(dist, dd, y),
+                           {key: np.interp(dist, dd, v) for key, v in zz.items()} if zz is not None else None)
+
+        return self._write(directory, interpolated())
+
+
+    def simplify(self, directory, tolerance):
+        """Simplify the route with the Douglas-Peucker algorithm, one chunk at a time. The first and last point of every chunk are kept, so the result may keep slightly more points than simplifying the whole route at once, but every chunk is within tolerance.
+
+        Args:
+            directory (str): directory for the new route files.
+            tolerance (float): maximum distance of removed points from the simplified route.
+
+        Returns:
+            ChunkedRoute: Return a new ChunkedRoute object.
+        """
+        def simplified():
+            for i, (x, y, zz, _) in enumerate(self.chunks()):
+                keep = significance(x, y) > tolerance
+                if i > 0:
+                    keep[0] = False
+
+                yield x[keep], y[keep], ({k: v[keep] for k, v in zz.items()} if zz is not None else None)
+
+        return self._write(directory, simplified())
@@ -0,0 +1,251 @@
+''' Routely codec '''
+
+import struct
+
+import numpy as np
+
+
+# Header layout: magic, format version, precision, number of points, number of z channels
+_MAGIC = b'RTLY'
+_VERSION = 1
+_HEADER = struct.Struct('<4sBbQH')
+_NAME_LEN = struct.Struct('<H')
+_CHANNEL = struct.Struct('<BQ')
+
+# Channel kinds
+_KIND_FLOAT = 0
+_KIND_INT = 1
+
+# A uint64 needs at most 10 groups of 7 bits
+_MAX_VARINT_BYTES = 10
+
+
+def zigzag_encode(values):
+    """Map signed integers onto unsigned integers so that small magnitudes give small codes, ie 0, -1, 1, -2, 2 -> 0, 1, 2, 3, 4.
+
+    Args:
+        values (array): 1d array of int64 values.
+
+    Returns:
+        array: 1d array of uint64 codes.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def zigzag_decode(codes):
+    """Inverse of zigzag_encode.
+
+    Args:
+        codes (array): 1d array of uint64 codes.
+
+    Returns:
+        array: 1d array of int64 values.
+    """
+    codes = np.asarray(codes, dtype=np.uint64)
+    return (codes >> np.uint64(1)).view(np.int64) ^ -(codes & np.uint64(1)).view(np.int64)
+
+
+def varint_encode(codes):
+    """Encode unsigned integers as little-endian base 128 varints. Each value is split into 7 bit groups with the high bit of each byte flagging that more bytes follow.
+
+    Args:
+        codes (array): 1d array of uint64 values.
+
+    Returns:
+        bytes: the encoded byte string.
+    """
+    codes = np.asarray(codes, dtype=np.uint64)
+    if codes.size == 0:
+        return b''
+
+    # 7 bit groups of every value, one column per group
+    shifts = np.arange(_MAX_VARINT_BYTES, dtype=np.uint64) * np.uint64(7)
+    groups = ((codes[:, None] >> shifts) & np.uint64(0x7f)).astype(np.uint8)
+
+    # Number of bytes needed for each value, at least one
+    nr_bytes = np.ones(codes.size, dtype=np.int64)
+    for k in range(1, _MAX_VARINT_BYTES):
+        nr_bytes += codes >= (np.uint64(1) << np.uint64(7*k))
+
+    # Set the continuation bit on all but the last byte of each value
+    cols = np.arange(_MAX_VARINT_BYTES)
+    groups[cols < (nr_bytes[:, None] - 1)] |= 0x80
+
+    # Keep only the used bytes, row-major order keeps the values in sequence
+    return groups[cols < nr_bytes[:, None]].tobytes()
+
+
+def varint_decode(buffer):
+    """Decode a byte string of little-endian base 128 varints.
+
+    Args:
+        buffer (bytes): byte string produced by varint_encode.
+
+    Returns:
+        array: 1d array of uint64 values.
+    """
+    b = np.frombuffer(buffer, dtype=np.uint8)
+    if b.size == 0:
+        return np.zeros(0, dtype=np.uint64)
+
+    ends = np.flatnonzero((b & 0x80) == 0)
+    if ends.size == 0 or ends[-1] != b.size - 1:
+        raise ValueError("Varint buffer is truncated")
+
+    starts = np.concatenate(([0], ends[:-1] + 1))
+
+    # Position of each byte within its value
+    value_idx = np.repeat(np.arange(starts.size), ends - starts + 1)
+    pos = np.arange(b.size) - starts[value_idx]
+    if pos.max() >= _MAX_VARINT_BYTES:
+        raise ValueError("Varint buffer contains a value wider than 64 bits")
+
+    # The 7 bit groups do not overlap so summing them reassembles each value
+    payload = (b & 0x7f).astype(np.uint64) << (pos.astype(np.uint64) * np.uint64(7))
+    return np.add.reduceat(payload, starts)
+
+
+def encode_channel(values, precision):
+    """Quantize, delta and zigzag varint encode a single channel of route data.
+
+    Float channels are rounded to 'precision' decimal places. Int channels are stored exactly.
+
+    Args:
+        values (array): 1d array of int or float values.
+        precision (int): number of decimal places retained for float channels.
+
+    Returns:
+        tuple: (channel kind, encoded bytes)
+    """
+    values = np.asarray(values)
+
+    if np.issubdtype(values.dtype, np.integer):
+        kind = _KIND_INT
+        if np.issubdtype(values.dtype, np.unsignedinteger) and len(values) and values.max() >= 2**63:
+            raise ValueError("Values are too large to be encoded as int64")
+        q = values.astype(np.int64)
+    else:
+        kind = _KIND_FLOAT
+        if not np.isfinite(values).all():
+            raise ValueError("Only finite values can be encoded")
+        scaled = np.rint(values * 10.0**precision)
+        if len(scaled) and np.abs(scaled).max() >= 2.0**63:
+            raise ValueError("Values are too large to be encoded at this precision")
+        q = scaled.astype(np.int64)
+
+    prev = np.r_[np.int64(0), q[:-1]]
+    deltas = q - prev
+
+    # int64 subtraction overflowed where the operands have different signs and the result differs in sign from q
+    if np.any(((q ^ prev) & (q ^ deltas)) < 0):
+        raise ValueError("Differences between consecutive values are too large to be encoded as int64")
+
+    return kind, varint_encode(zigzag_encode(deltas))
+
+
+def decode_channel(kind, buffer, precision):
+    """Inverse of encode_channel.
+
+    Args:
+        kind (int): channel kind returned by encode_channel.
+        buffer (bytes): encoded bytes returned by encode_channel.
+        precision (int): number of decimal places used when encoding.
+
+    Returns:
+        array: 1d array of decoded values.
+    """
+    q = zigzag_decode(varint_decode(buffer)).cumsum()
+
+    if kind == _KIND_INT:
+        return q
+    elif kind == _KIND_FLOAT:
+        return q / 10.0**precision
+    else:
+        raise ValueError("Unknown channel kind in route buffer")
+
+
+def encode_route(x, y, z, precision):
+    """Encode route x, y and z data into a compact byte string. Distance is not stored.
+
+    Args:
+        x (array): 1d array of x-coordinates.
+        y (array): 1d array of y-coordinates.
+        z (dict): dict of z data arrays, or None.
+        precision (int): number of decimal places retained for float channels.
+
+    Returns:
+        bytes: the encoded route.
+    """
+    if not -128 <= precision <= 127:
+        raise ValueError("'precision' must be between -128 and 127")
+
+    z = z or {}
+    parts = [_HEADER.pack(_MAGIC, _VERSION, precision, len(x), len(z))]
+
+    for name in z.keys():
+        name = str(name).encode('utf-8')
+        parts.append(_NAME_LEN.pack(len(name)))
+        parts.append(name)
+
+    channels = [encode_channel(v, precision) for v in [x, y, *z.values()]]
+    parts.extend(_CHANNEL.pack(kind, len(buffer)) for kind, buffer in channels)
+    parts.extend(buffer for _, buffer in channels)
+
+    return b''.join(parts)
+
+
+def _check_length(buffer, offset, size):
+    """Raise a ValueError if fewer than size bytes remain in the buffer after offset.
+    """
+    if len(buffer) - offset < size:
+        raise ValueError("Route buffer is truncated")
+
+
+def decode_route(buffer):
+    """Decode a byte string produced by encode_route.
+
+    Args:
+        buffer (bytes): the encoded route.
+
+    Returns:
+        tuple: (x, y, z) where z is a dict of arrays, or None if the route had no z data.
+    """
+    buffer = memoryview(buffer)
+
+    _check_length(buffer, 0, _HEADER.size)
+    magic, version, precision, nr_points, nr_z = _HEADER.unpack_from(buffer, 0)
+    if magic != _MAGIC:
+        raise ValueError("Buffer is not an encoded route")
+    if version != _VERSION:
+        raise ValueError(f"Unsupported route buffer version {version}")
+    offset = _HEADER.size
+
+    names = []
+    for _ in range(nr_z):
+        _check_length(buffer, offset, _NAME_LEN.size)
+        (length,) = _NAME_LEN.unpack_from(buffer, offset)
+        offset += _NAME_LEN.size
+        _check_length(buffer, offset, length)
+        names.append(bytes(buffer[offset:offset + length]).decode('utf-8'))
+        offset += length
+
+    specs = []
+    for _ in range(nr_z + 2):
+        _check_length(buffer, offset, _CHANNEL.size)
+        specs.append(_CHANNEL.unpack_from(buffer, offset))
+        offset += _CHANNEL.size
+
+    channels = []
+    for kind, length in specs:
+        _check_length(buffer, offset, length)
+        values = decode_channel(kind, buffer[offset:offset + length], precision)
+        if len(values) != nr_points:
+            raise ValueError("Route buffer is corrupt, channel length does not match number of points")
+        channels.append(values)
+        offset += length
+
+    x, y = channels[0], channels[1]
+    z = dict(zip(names, channels[2:])) if nr_z else None
+
+    return x, y, z
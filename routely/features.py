@@ -0,0 +1,114 @@
+''' Routely features '''
+
+import numpy as np
+
+
+_NORMALIZATIONS = ('center_on_origin', 'fit_to_box')
+
+
+def resample_many(routes, num, channels=('x', 'y'), normalize=None, box_size=(1, 1), keep_aspect=True, out=None):
+    """Resample many Routes onto a common number of points and write them into a single (routes, points, channels) feature matrix, for example as fixed length inputs for machine learning.
+
+    This gives the same result as calling interpolate(kind='absolute_steps', num=num) on each route, applying any normalizations, then stacking the chosen columns of dataframe(). Instead of a Python call per route, the coordinates of all routes are concatenated and every route is interpolated in one vectorized pass.
+
+    Args:
+        routes (list): list of Route objects.
+        num (int): number of points to resample each route to, spaced linearly along the route.
+        channels (list, optional): columns to include, any of 'x', 'y', 'd' and the routes' z data keys. Defaults to ('x', 'y').
+        normalize (str or list, optional): normalizations applied to x and y in order. Options: 'center_on_origin' (as Route.center_on_origin()) and 'fit_to_box' (as Route.fit_to_box()). Defaults to None.
+        box_size (tuple, optional): (width, height) of the box for 'fit_to_box'. Defaults to (1, 1).
+        keep_aspect (bool, optional): keep_aspect argument for 'fit_to_box'. Defaults to True.
+        out (array, optional): preallocated float array of shape (len(routes), num, len(channels)) to write into. Defaults to None.
+
+    Returns:
+        array: (len(routes), num, len(channels)) float array.
+    """
+    routes = list(routes)
+    channels = list(channels)
+    n = len(routes)
+
+    if normalize is None:
+        normalize = []
+    elif isinstance(normalize, str):
+        normalize = [normalize]
+    if any(k not in _NORMALIZATIONS for k in normalize):
+        raise ValueError(f"'normalize' not recognised. Choose from {_NORMALIZATIONS}.")
+
+    if num < 2:
+        raise ValueError("'num' must be at least 2")
+
+    shape = (n, num, len(channels))
+    if out is None:
+        out = np.empty(shape)
+    elif out.shape != shape:
+        raise ValueError(f"'out' must have shape {shape}")
+
+    if n == 0:
+        return out
+
+    # concatenate all routes
+    sizes = np.array([r.nr_points() for r in routes])
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    ends = starts + sizes - 1
+
+    d = np.concatenate([r.d for r in routes]).astype(float)
+
+    # linearly spaced query distances per route
+    d_min, d_max = d[starts], d[ends]
+    q = d_min[:, None] + (d_max - d_min)[:, None]*np.linspace(0, 1, num)[None, :]
+    q = q.ravel()
+    q_id = np.repeat(np.arange(n), num)
+
+    # bisect within each route's distances for the segment each query falls in, for all queries at once
+    lo = starts[q_id]
+    hi = ends[q_id] - 1
+    for _ in range(int(np.ceil(np.log2(sizes.max())))):
+        mid = (lo + hi + 1)//2
+        below = d[mid] <= q
+        lo = np.where(below, mid, lo)
+        hi = np.where(below, hi, mid - 1)
+    left = lo
+
+    span = d[left + 1] - d[left]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frac = np.where(span > 0, (q - d[left])/span, 0.)
+
+    def resample(values):
+        v0 = values[left]
+        return (v0 + frac*(values[left + 1] - v0)).reshape(n, num)
+
+    if {'x', 'y', 'd'} & set(channels):
+        x = resample(np.concatenate([r.x for r in routes]).astype(float))
+        y = resample(np.concatenate([r.y for r in routes]).astype(float))
+
+        for kind in normalize:
+            if kind == 'center_on_origin':
+                x -= ((x.max(axis=1) + x.min(axis=1))/2.)[:, None]
+                y -= ((y.max(axis=1) + y.min(axis=1))/2.)[:, None]
+
+            elif kind == 'fit_to_box':
+                width = x.max(axis=1) - x.min(axis=1)
+                height = y.max(axis=1) - y.min(axis=1)
+                if keep_aspect:
+                    sx = sy = np.maximum(height/box_size[1], width/box_size[0])
+                else:
+                    sx = np.abs(width/box_size[0])
+                    sy = np.abs(height/box_size[1])
+                x /= sx[:, None]
+                y /= sy[:, None]
+
+    for c, name in enumerate(channels):
+        if name == 'x':
+            out[:, :, c] = x
+        elif name == 'y':
+            out[:, :, c] = y
+        elif name == 'd':
+            # distance along the resampled and normalized points, as a new Route would calculate it
+            out[:, 0, c] = 0
+            np.cumsum(np.hypot(np.diff(x, axis=1), np.diff(y, axis=1)), axis=1, out=out[:, 1:, c])
+        else:
+            if any(r.z is None or name not in r.z for r in routes):
+                raise ValueError(f"Channel '{name}' is not in the z data of every route")
+            out[:, :, c] = resample(np.concatenate([r.z[name] for r in routes]).astype(float))
+
+    return out
@@ -0,0 +1,148 @@
+''' Routely filters '''
+
+import numpy as np
+
+from scipy.linalg import solve_discrete_are
+from scipy.signal import lfilter, ss2tf
+
+from .routely import Route
+
+
+class KalmanFilter:
+    """
+    Create a streaming constant-velocity Kalman filter for smoothing route points as they arrive.
+
+    Each of x, y and any z data is modelled as a position and velocity that change by one time step per point, with random acceleration as process noise and measurement noise on each observed value. The filter runs with its steady-state gain, which makes it a fixed second order recursive filter. Points can be passed one at a time with update() or in micro-batches with update_batch() at a fixed cost per point, and apply() filters a finished Route in a single vectorized pass. All three give the same output for the same points.
+
+    Args:
+        process_noise (float, optional) : Variance of the random acceleration between points. Defaults to 1.0.
+
+        measurement_noise (float, optional) : Variance of the noise on each observed value. Only the ratio of measurement to process noise affects the output, with higher ratios giving more smoothing. Defaults to 10.0.
+    """
+
+    def __init__(self, process_noise=1.0, measurement_noise=10.0):
+
+        if not (process_noise > 0 and measurement_noise > 0):
+            raise ValueError("'process_noise' and 'measurement_noise' must be greater than 0")
+
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+
+        self._design()
+        self.reset()
+
+
+    def _design(self):
+        """Solve for the steady-state gain and express the filter as an IIR filter for scipy.signal.lfilter.
+        """
+        F = np.array([[1., 1.], [0., 1.]])
+        H = np.array([[1., 0.]])
+        G = np.array([[0.5], [1.]])
+        Q = G @ G.T * self.process_noise
+        R = np.array([[self.measurement_noise]])
+
+        # steady-state prior covariance and gain
+        P = solve_discrete_are(F.T, H.T, Q, R)
+        K = P @ H.T / (H @ P @ H.T + R)
+
+        # the state after each update is A @ state + K * measurement, output is its position
+        A = (np.eye(2) - K @ H) @ F
+        C = H @ A
+        D = H @ K
+
+        b, a = ss2tf(A, K, C, D)
+        self.gain = K.ravel()
+        self._A = A
+        self._C = C
+        self._b = b.ravel()
+        self._a = a
+
+
+    def _initial_conditions(self, position):
+        """Get lfilter initial conditions for a filter state of the given position and zero velocity.
+        """
+        state = np.stack((position, np.zeros_like(position)))
+        zi0 = self._C @ state
+        zi1 = (self._C @ self._A + self._a[1]*self._C) @ state
+        return np.concatenate((zi0, zi1))
+
+
+    def reset(self):
+        """Reset the filter so that the next point starts a new track.
+        """
+        self._zi = None
+        self._keys = None
+
+
+    def _stack(self, x, y, z):
+        """Stack x, y and z data into a (n, channels) array.
+        """
+        columns = [np.atleast_1d(np.asarray(x, dtype=float)), np.atleast_1d(np.asarray(y, dtype=float))]
+        keys = list(z.keys()) if z is not None else []
+
+        if self._keys is not None and keys != self._keys:
+            raise ValueError("z data keys must be the same for every update")
+
+        for k in keys:
+            columns.append(np.atleast_1d(np.asarray(z[k], dtype=float)))
+
+        return np.stack(columns, axis=1), keys
+
+
+    def update_batch(self, x, y, z=None):
+        """Filter a micro-batch of consecutive points, continuing from any points already filtered.
+
+        Args:
+            x (array-like): x-coordinates of the points.
+            y (array-like): y-coordinates of the points.
+            z (dict, optional): z data of the points. Keys must be the same for every update. Defaults to None.
+
+        Returns:
+            tuple: (x, y, z) arrays of the filtered points, where z is a dict or None.
+        """
+        data, keys = self._stack(x, y, z)
+
+        out = np.empty_like(data)
+        start = 0
+
+        # a new track starts at its first point with zero velocity
+        if self._zi is None and len(data) > 0:
+            self._keys = keys
+            self._zi = self._initial_conditions(data[0])
+            out[0] = data[0]
+            start = 1
+
+        if len(data) > start:
+            out[start:], self._zi = lfilter(self._b, self._a, data[start:], axis=0, zi=self._zi)
+
+        zz = {k: out[:, i + 2] for i, k in enumerate(keys)} if keys else None
+        return out[:, 0], out[:, 1], zz
+
+
+    def update(self, x, y, z=None):
+        """Filter a single point, continuing from any points already filtered.
+
+        Args:
+            x (float): x-coordinate of the point.
+            y (float): y-coordinate of the point.
+            z (dict, optional): z data of the point. Keys must be the same for every update. Defaults to None.
+
+        Returns:
+            tuple: (x, y, z) of the filtered point, where z is a dict or None.
+        """
+        xx, yy, zz = self.update_batch([x], [y], {k: [v] for k, v in z.items()} if z is not None else None)
+        return xx[0], yy[0], ({k: v[0] for k, v in zz.items()} if zz is not None else None)
+
+
+    def apply(self, route):
+        """Filter a complete Route in one pass. This does not affect the state of any streaming updates.
+
+        Args:
+            route (Route): route to filter.
+
+        Returns:
+            Route: Return a new Route object.
+        """
+        f = KalmanFilter(self.process_noise, self.measurement_noise)
+        x, y, z = f.update_batch(route.x, route.y, route.z)
+        return Route(x, y, z=z)
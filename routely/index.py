@@ -0,0 +1,504 @@
+''' Routely spatial index '''
+
+import json
+import math
+import os
+import tempfile
+
+import numpy as np
+
+
+_MAGIC = b'RTLYIDX1'
+_ALIGN = 64
+
+
+def _as_boxes(bboxes):
+    """Convert bounding boxes to a float (n, 4) array of [xmin, ymin, xmax, ymax] rows. Accepts Route.bbox() tuples ((xmin, ymin), (xmax, ymax)) or flat rows.
+    """
+    boxes = np.asarray(bboxes, dtype=float).reshape(-1, 4)
+    if (boxes[:, 0] > boxes[:, 2]).any() or (boxes[:, 1] > boxes[:, 3]).any():
+        raise ValueError("Bounding boxes must be given as (lower-left corner, upper-right corner)")
+    return boxes
+
+
+def _route_boxes(routes):
+    """Get the (n, 4) array of bounding boxes for a list of Routes.
+    """
+    boxes = np.empty((len(routes), 4))
+    for i, r in enumerate(routes):
+        boxes[i] = np.ravel(r.bbox())
+    return boxes
+
+
+def _point_box_distance(px, py, boxes):
+    """Get the min and max Euclidean distance between points and boxes, broadcasting over both. Min distance is zero if the point is inside the box.
+    """
+    dx = np.maximum(np.maximum(boxes[..., 0] - px, px - boxes[..., 2]), 0)
+    dy = np.maximum(np.maximum(boxes[..., 1] - py, py - boxes[..., 3]), 0)
+    mx = np.maximum(np.abs(px - boxes[..., 0]), np.abs(px - boxes[..., 2]))
+    my = np.maximum(np.abs(py - boxes[..., 1]), np.abs(py - boxes[..., 3]))
+    return np.hypot(dx, dy), np.hypot(mx, my)
+
+
+def _group_starts(keys):
+    """Get the index of the first item of each run of equal keys in a sorted array.
+    """
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+
+class RouteIndex:
+    """
+    Create a spatial index over the bounding boxes of many Routes.
+
+    The index is an R-tree bulk loaded with the Sort-Tile-Recursive (STR) algorithm and stored as flat arrays, one array of node boxes per tree level. Rectangle and nearest neighbour queries traverse the tree one level at a time for all queries at once. Inserted items are held in a small buffer and deleted items are masked out until the tree is rebuilt, which happens automatically once the buffer grows beyond a fraction of the index size.
+
+    Args:
+        bboxes (array-like, optional) : Bounding boxes of the items as returned by Route.bbox(), or as rows of [xmin, ymin, xmax, ymax]. Defaults to None.
+
+        ids (array-like, optional) : Unique integer ids of the items. Defaults to None, in which case items are numbered from 0.
+
+        node_size (int, optional) : Maximum number of children of each tree node. Defaults to 16.
+
+        rebuild_fraction (float, optional) : Rebuild the tree when the number of buffered inserts exceeds this fraction of the index size. Defaults to 0.1.
+    """
+
+    def __init__(self, bboxes=None, ids=None, node_size=16, rebuild_fraction=0.1):
+
+        if node_size < 2:
+            raise ValueError("'node_size' must be at least 2")
+
+        self.node_size = int(node_size)
+        self.rebuild_fraction = rebuild_fraction
+
+        boxes = _as_boxes(bboxes if bboxes is not None else np.empty((0, 4)))
+
+        if ids is None:
+            ids = np.arange(len(boxes), dtype=np.int64)
+        else:
+            ids = np.asarray(ids, dtype=np.int64)
+            if len(ids) != len(boxes):
+                raise ValueError("'ids' must be of equal length to 'bboxes'")
+            if len(np.unique(ids)) != len(ids):
+                raise ValueError("'ids' must be unique")
+
+        self._bulk_load(boxes, ids)
+
+
+    @classmethod
+    def from_routes(cls, routes, ids=None, **kwargs):
+        """Create a RouteIndex from the bounding boxes of a list of Routes.
+
+        Args:
+            routes (list): list of Route objects.
+            ids (array-like, optional): Unique integer ids of the routes. Defaults to None, in which case routes are numbered by list position.
+
+        Returns:
+            RouteIndex: Return a new RouteIndex object.
+        """
+        return cls(_route_boxes(routes), ids=ids, **kwargs)
+
+
+    def _bulk_load(self, boxes, ids):
+        """Sort items into STR order and build the node levels above them.
+        """
+        n = len(boxes)
+        b = self.node_size
+
+        if n > 0:
+            # Sort by x center into vertical slices, then by y center within each slice
+            cx = boxes[:, 0] + boxes[:, 2]
+            cy = boxes[:, 1] + boxes[:, 3]
+            nr_slices = math.ceil(math.sqrt(math.ceil(n/b)))
+            slice_size = nr_slices * b
+
+            by_x = np.argsort(cx, kind='stable')
+            slice_idx = np.empty(n, dtype=np.int64)
+            slice_idx[by_x] = np.arange(n) // slice_size
+            order = np.lexsort((cy, slice_idx))
+
+            boxes = boxes[order]
+            ids = ids[order]
+
+        self._boxes = np.ascontiguousarray(boxes)
+        self._ids = np.ascontiguousarray(ids)
+        self._levels = self._build_levels(self._boxes)
+        self._reset_state()
+
+
+    def _build_levels(self, boxes):
+        """Build the node boxes of each tree level, from the level directly above the items up to the root.
+        """
+        levels = []
+        child = boxes
+        while len(child) > 1 or (not levels and len(child) > 0):
+            starts = np.arange(0, len(child), self.node_size)
+            nodes = np.empty((len(starts), 4))
+            nodes[:, 0] = np.minimum.reduceat(child[:, 0], starts)
+            nodes[:, 1] = np.minimum.reduceat(child[:, 1], starts)
+            nodes[:, 2] = np.maximum.reduceat(child[:, 2], starts)
+            nodes[:, 3] = np.maximum.reduceat(child[:, 3], starts)
+            levels.append(nodes)
+            child = nodes
+
+        return levels
+
+
+    def _reset_state(self):
+        """Reset the mutable state held alongside the packed tree.
+        """
+        self._alive = np.ones(len(self._ids), dtype=bool)
+        self._nr_deleted = 0
+        self._id_order = None
+        self._counts = None
+        self._pending_boxes = []
+        self._pending_ids = []
+        self._next_id = int(self._ids.max()) + 1 if len(self._ids) else 0
+
+
+    def __len__(self):
+        return len(self._ids) - self._nr_deleted + len(self._pending_ids)
+
+
+    def ids(self):
+        """Get the ids of all items in the index.
+
+        Returns:
+            array: 1d array of item ids.
+        """
+        return np.concatenate((self._ids[self._alive], np.array(self._pending_ids, dtype=np.int64)))
+
+
+    def _find(self, item_id):
+        """Get the position of an id among the packed items, or None if it is not there.
+        """
+        if self._id_order is None:
+            self._id_order = np.argsort(self._ids, kind='stable')
+
+        i = np.searchsorted(self._ids, item_id, sorter=self._id_order)
+        if i < len(self._ids):
+            pos = self._id_order[i]
+            if self._ids[pos] == item_id and self._alive[pos]:
+                return pos
+        return None
+
+
+    def __contains__(self, item_id):
+        return self._find(item_id) is not None or item_id in self._pending_ids
+
+
+    def insert(self, bbox, item_id=None):
+        """Insert an item into the index.
+
+        Args:
+            bbox (tuple or Route): bounding box of the item as returned by Route.bbox(), or a Route.
+            item_id (int, optional): unique id of the item. Defaults to None, in which case the next unused id is assigned.
+
+        Returns:
+            int: id of the inserted item.
+        """
+        if hasattr(bbox, 'bbox'):
+            bbox = bbox.bbox()
+        box = _as_boxes(bbox)[0]
+
+        if item_id is None:
+            item_id = self._next_id
+        elif item_id in self:
+            raise ValueError(f"An item with id {item_id} already exists in the index")
+
+        item_id = int(item_id)
+        self._pending_boxes.append(box)
+        self._pending_ids.append(item_id)
+        self._next_id = max(self._next_id, item_id + 1)
+
+        if len(self._pending_ids) > max(self.node_size, self.rebuild_fraction * len(self._ids)):
+            self.rebuild()
+
+        return item_id
+
+
+    def delete(self, item_id):
+        """Delete an item from the index.
+
+        Args:
+            item_id (int): id of the item.
+        """
+        pos = self._find(item_id)
+
+        if pos is not None:
+            self._alive[pos] = False
+            self._nr_deleted += 1
+            self._counts = None
+        elif item_id in self._pending_ids:
+            i = self._pending_ids.index(item_id)
+            del self._pending_ids[i]
+            del self._pending_boxes[i]
+        else:
+            raise KeyError(item_id)
+
+        if self._nr_deleted > self.rebuild_fraction * len(self._ids):
+            self.rebuild()
+
+
+    def rebuild(self):
+        """Rebuild the packed tree, merging buffered inserts and dropping deleted items.
+        """
+        boxes = np.concatenate((self._boxes[self._alive], np.array(self._pending_boxes).reshape(-1, 4)))
+        ids = np.concatenate((self._ids[self._alive], np.array(self._pending_ids, dtype=np.int64)))
+        next_id = self._next_id
+
+        self._bulk_load(boxes, ids)
+        self._next_id = next_id
+
+
+    def _pending(self):
+        """Get the buffered inserts as arrays.
+        """
+        return np.array(self._pending_boxes).reshape(-1, 4), np.array(self._pending_ids, dtype=np.int64)
+
+
+    def _expand(self, qidx, nodes, nr_children):
+        """Expand (query, node) pairs into (query, child) pairs.
+        """
+        children = (nodes[:, None] * self.node_size + np.arange(self.node_size)).ravel()
+        qidx = np.repeat(qidx, self.node_size)
+        keep = children < nr_children
+        return qidx[keep], children[keep]
+
+
+    def _child_counts(self):
+        """Get the number of live items below each node, per level.
+        """
+        if self._counts is None:
+            counts = []
+            child = self._alive.astype(np.int64)
+            for nodes in self._levels:
+                child = np.add.reduceat(child, np.arange(0, len(child), self.node_size))
+                counts.append(child)
+            self._counts = counts
+
+        return self._counts
+
+
+    def query_many(self, bboxes):
+        """Find the items whose bounding boxes intersect each of many query rectangles.
+
+        Args:
+            bboxes (array-like): query rectangles as Route.bbox() tuples or rows of [xmin, ymin, xmax, ymax].
+
+        Returns:
+            list: list of 1d arrays of item ids, one array per query rectangle.
+        """
+        queries = _as_boxes(bboxes)
+        qidx = np.zeros(0, dtype=np.int64)
+        items = np.zeros(0, dtype=np.int64)
+
+        def intersects(q, boxes):
+            return ((boxes[..., 0] <= q[..., 2]) & (boxes[..., 2] >= q[..., 0]) &
+                    (boxes[..., 1] <= q[..., 3]) & (boxes[..., 3] >= q[..., 1]))
+
+        if self._levels:
+            # Start with every query paired with the root
+            qidx = np.arange(len(queries))
+            nodes = np.zeros(len(queries), dtype=np.int64)
+
+            for level in range(len(self._levels) - 1, -1, -1):
+                keep = intersects(queries[qidx], self._levels[level][nodes])
+                qidx, nodes = qidx[keep], nodes[keep]
+                below = self._levels[level - 1] if level > 0 else self._boxes
+                qidx, nodes = self._expand(qidx, nodes, len(below))
+
+            keep = intersects(queries[qidx], self._boxes[nodes]) & self._alive[nodes]
+            qidx, items = qidx[keep], self._ids[nodes[keep]]
+
+        # Scan buffered inserts directly
+        pending_boxes, pending_ids = self._pending()
+        if len(pending_ids):
+            pq, pi = np.nonzero(intersects(queries[:, None, :], pending_boxes[None, :, :]))
+            qidx = np.concatenate((qidx, pq))
+            items = np.concatenate((items, pending_ids[pi]))
+
+        order = np.argsort(qidx, kind='stable')
+        qidx, items = qidx[order], items[order]
+        splits = np.searchsorted(qidx, np.arange(1, len(queries)))
+        return np.split(items, splits)
+
+
+    def query(self, bbox):
+        """Find the items whose bounding boxes intersect a query rectangle, for example a map viewport.
+
+        Args:
+            bbox (tuple): query rectangle as (lower-left corner coordinates, upper-right corner coordinates).
+
+        Returns:
+            array: 1d array of item ids.
+        """
+        return self.query_many([bbox])[0]
+
+
+    def nearest_many(self, points, k=1, return_distance=False):
+        """Find the k items with bounding boxes nearest to each of many points. Distance is zero for points inside a bounding box.
+
+        Args:
+            points (array-like): (x, y) query points.
+            k (int, optional): number of nearest items to find per point. Defaults to 1.
+            return_distance (bool, optional): If True, also return the distance to each item. Defaults to False.
+
+        Returns:
+            list: list of 1d arrays of item ids, one array per point, ordered nearest first. If return_distance, a list of (ids, distances) tuples.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        nr_q = len(points)
+        qidx = np.zeros(0, dtype=np.int64)
+        items = np.zeros(0, dtype=np.int64)
+        dist = np.zeros(0)
+
+        if self._levels and len(self._ids) > self._nr_deleted:
+            counts = self._child_counts()
+            qidx = np.arange(nr_q)
+            nodes = np.zeros(nr_q, dtype=np.int64)
+
+            for level in range(len(self._levels) - 1, -1, -1):
+                node_counts = counts[level][nodes]
+                mind, maxd = _point_box_distance(points[qidx, 0], points[qidx, 1], self._levels[level][nodes])
+
+                # Every item in a node is at most maxd away, so the smallest maxd that covers k items bounds the k-th nearest distance
+                order = np.lexsort((maxd, qidx))
+                sq, smax, scount = qidx[order], maxd[order], node_counts[order]
+                cum = scount.cumsum()
+                starts = _group_starts(sq)
+                offsets = np.repeat(cum[starts] - scount[starts], np.diff(np.r_[starts, len(sq)]))
+                covered = (cum - offsets) >= k
+
+                bound = np.full(nr_q, np.inf)
+                np.minimum.at(bound, sq[covered], smax[covered])
+
+                keep = (mind <= bound[qidx]) & (node_counts > 0)
+                qidx, nodes = qidx[keep], nodes[keep]
+                below = self._levels[level - 1] if level > 0 else self._boxes
+                qidx, nodes = self._expand(qidx, nodes, len(below))
+
+            keep = self._alive[nodes]
+            qidx, nodes = qidx[keep], nodes[keep]
+            dist, _ = _point_box_distance(points[qidx, 0], points[qidx, 1], self._boxes[nodes])
+            items = self._ids[nodes]
+
+        pending_boxes, pending_ids = self._pending()
+        if len(pending_ids):
+            pd_, _ = _point_box_distance(points[:, 0, None], points[:, 1, None], pending_boxes[None, :, :])
+            qidx = np.concatenate((qidx, np.repeat(np.arange(nr_q), len(pending_ids))))
+            items = np.concatenate((items, np.tile(pending_ids, nr_q)))
+            dist = np.concatenate((dist, pd_.ravel()))
+
+        # Keep the k nearest candidates of each query
+        order = np.lexsort((items, dist, qidx))
+        qidx, items, dist = qidx[order], items[order], dist[order]
+        starts = _group_starts(qidx) if len(qidx) else np.zeros(0, dtype=np.int64)
+        rank = np.arange(len(qidx)) - np.repeat(starts, np.diff(np.r_[starts, len(qidx)]))
+        keep = rank < k
+        qidx, items, dist = qidx[keep], items[keep], dist[keep]
+
+        splits = np.searchsorted(qidx, np.arange(1, nr_q))
+        ids = np.split(items, splits)
+        if return_distance:
+            return list(zip(ids, np.split(dist, splits)))
+        return ids
+
+
+    def nearest(self, point, k=1, return_distance=False):
+        """Find the k items with bounding boxes nearest to a point. Distance is zero for points inside a bounding box.
+
+        Args:
+            point (tuple): (x, y) query point.
+            k (int, optional): number of nearest items to find. Defaults to 1.
+            return_distance (bool, optional): If True, also return the distance to each item. Defaults to False.
+
+        Returns:
+            array: 1d array of item ids ordered nearest first. If return_distance, a tuple of (ids, distances).
+        """
+        return self.nearest_many([point], k=k, return_distance=return_distance)[0]
+
+
+    def save(self, path):
+        """Save the index to a file that can be memory-mapped by load. Buffered inserts and deletes are merged first.
+
+        Args:
+            path (str): file path.
+        """
+        if self._pending_ids or self._nr_deleted:
+            self.rebuild()
+
+        arrays = {'boxes': self._boxes, 'ids': self._ids}
+        for i, nodes in enumerate(self._levels):
+            arrays[f'level_{i}'] = nodes
+
+        header = {'node_size': self.node_size, 'rebuild_fraction': self.rebuild_fraction,
+                  'next_id': self._next_id, 'nr_levels': len(self._levels), 'arrays': {}}
+
+        # Lay out arrays at aligned offsets after the header
+        header_size = 4096
+        while True:
+            offset = header_size
+            for name, a in arrays.items():
+                header['arrays'][name] = {'dtype': a.dtype.str, 'shape': list(a.shape), 'offset': offset}
+                offset += -(-a.nbytes // _ALIGN) * _ALIGN
+            encoded = json.dumps(header).encode('utf-8')
+            if len(_MAGIC) + 8 + len(encoded) <= header_size:
+                break
+            header_size *= 2
+
+        # write to a temporary file and replace, as the arrays may be memory-mapped from the file at path
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_MAGIC)
+                f.write(len(encoded).to_bytes(8, 'little'))
+                f.write(encoded)
+                for name, a in arrays.items():
+                    f.seek(header['arrays'][name]['offset'])
+                    f.write(np.ascontiguousarray(a).tobytes())
+                f.truncate(offset)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load an index saved with save. The tree is not rebuilt.
+
+        Args:
+            path (str): file path.
+            mmap (bool, optional): If True, the tree arrays are memory-mapped read-only rather than read into memory. Defaults to True.
+
+        Returns:
+            RouteIndex: Return a new RouteIndex object.
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError("File is not a saved RouteIndex")
+            length = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(length).decode('utf-8'))
+
+        def read(name):
+            spec = header['arrays'][name]
+            shape = tuple(spec['shape'])
+            if np.prod(shape) == 0:
+                return np.empty(shape, dtype=spec['dtype'])
+            if mmap:
+                return np.memmap(path, dtype=spec['dtype'], mode='r', offset=spec['offset'], shape=shape)
+            with open(path, 'rb') as f:
+                f.seek(spec['offset'])
+                return np.fromfile(f, dtype=spec['dtype'], count=int(np.prod(shape))).reshape(shape)
+
+        index = cls.__new__(cls)
+        index.node_size = header['node_size']
+        index.rebuild_fraction = header['rebuild_fraction']
+        index._boxes = read('boxes')
+        index._ids = read('ids')
+        index._levels = [read(f'level_{i}') for i in range(header['nr_levels'])]
+        index._reset_state()
+        index._next_id = header['next_id']
+
+        return index
@@ -0,0 +1,208 @@
+''' Routely level of detail '''
+
+import math
+
+import numpy as np
+
+
+def significance(x, y):
+    """Get the Douglas-Peucker significance of each point of a line, being the largest simplification tolerance at which the point is kept. Simplifying with tolerance t keeps the points with significance greater than t. End points are always kept.
+
+    The recursion is run breadth first, splitting every segment at the same depth in one vectorized step. A point's significance is capped by that of the point which split its parent segment, so that simplifications at increasing tolerances are nested subsets of each other.
+
+    Args:
+        x (array): 1d array of x-coordinates.
+        y (array): 1d array of y-coordinates.
+
+    Returns:
+        array: 1d array of significance per point.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+
+    sig = np.zeros(n)
+    sig[[0, -1]] = np.inf
+
+    # active segments as (start, end, parent significance)
+    start = np.array([0])
+    end = np.array([n - 1])
+    cap = np.array([np.inf])
+
+    while len(start):
+        keep = end - start > 1
+        start, end, cap = start[keep], end[keep], cap[keep]
+        if not len(start):
+            break
+
+        # distance of every interior point to its segment chord
+        counts = end - start - 1
+        seg = np.repeat(np.arange(len(start)), counts)
+        idx = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + start[seg] + 1
+
+        ax, ay = x[start[seg]], y[start[seg]]
+        dx, dy = x[end[seg]] - ax, y[end[seg]] - ay
+        length = np.hypot(dx, dy)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dist = np.abs(dx*(y[idx] - ay) - dy*(x[idx] - ax))/length
+        dist = np.where(length > 0, dist, np.hypot(x[idx] - ax, y[idx] - ay))
+
+        # furthest point of each segment
+        offsets = np.cumsum(counts) - counts
+        order = np.lexsort((-dist, seg))
+        first = order[offsets]
+        split = idx[first]
+        split_sig = np.minimum(dist[first], cap)
+        sig[split] = split_sig
+
+        start, end, cap = np.r_[start, split], np.r_[split, end], np.r_[split_sig, split_sig]
+
+    return sig
+
+
+class LevelOfDetail:
+    """
+    A pyramid of progressively simplified versions of a Route, as created by Route.build_lod().
+
+    Level 0 is the full resolution route. Level k > 0 is the Douglas-Peucker simplification at tolerance min_tolerance * 2**(k - 1), so the level for a requested tolerance is found directly from its logarithm. Each level is stored as an index array into the points of the original route, and the simplified Routes are created on first request and then cached.
+
+    Args:
+        route (Route) : the full resolution route.
+
+        indexes (list) : list of 1d index arrays, one per level.
+
+        min_tolerance (float) : tolerance of level 1.
+    """
+
+    def __init__(self, route, indexes, min_tolerance):
+
+        self.route = route
+        self.indexes = indexes
+        self.min_tolerance = float(min_tolerance)
+        self._routes = {}
+
+
+    @classmethod
+    def build(cls, route, levels=8, min_tolerance=None):
+        """Build the pyramid for a Route. See Route.build_lod().
+        """
+        if levels < 1:
+            raise ValueError("'levels' must be at least 1")
+
+        if min_tolerance is None:
+            min_tolerance = max(route.size())/2**(levels + 2)
+        if not min_tolerance > 0:
+            raise ValueError("'min_tolerance' must be greater than 0")
+
+        sig = significance(route.x, route.y)
+        indexes = [np.arange(route.nr_points())]
+        for k in range(1, levels):
+            indexes.append(np.flatnonzero(sig > min_tolerance*2**(k - 1)))
+
+        return cls(route, indexes, min_tolerance)
+
+
+    def nr_levels(self):
+        """Get the number of levels in the pyramid.
+
+        Returns:
+            int: number of levels.
+        """
+        return len(self.indexes)
+
+
+    def tolerances(self):
+        """Get the simplification tolerance of each level.
+
+        Returns:
+            array: 1d array of tolerances, starting with 0 for the full resolution level.
+        """
+        return np.r_[0., self.min_tolerance*2.**np.arange(self.nr_levels() - 1)]
+
+
+    def level_for(self, tolerance=None, pixel_size=None):
+        """Get the coarsest level whose tolerance does not exceed the requested tolerance.
+
+        Args:
+            tolerance (float, optional): maximum allowed deviation from the full resolution route.
+            pixel_size (float, optional): size of a screen pixel in route units. Used as the tolerance if tolerance is not given.
+
+        Returns:
+            int: level number.
+        """
+        if tolerance is None:
+            tolerance = pixel_size
+        if tolerance is None:
+            raise ValueError("Either 'tolerance' or 'pixel_size' must be given")
+
+        if tolerance < self.min_tolerance:
+            return 0
+        return min(1 + int(math.floor(math.log2(tolerance/self.min_tolerance))), self.nr_levels() - 1)
+
+
+    def level(self, k):
+        """Get the Route at a level of the pyramid.
+
+        Args:
+            k (int): level number.
+
+        Returns:
+            Route: the simplified route. This is the original Route object for level 0.
+        """
+        if k == 0:
+            return self.route
+
+        if k not in self._routes:
+            r = self.route
+            idx = self.indexes[k]
+            x, y = r.x[idx], r.y[idx]
+            d = np.r_[0., np.cumsum(np.hypot(np.diff(x), np.diff(y)))]
+            zz = {key: v[idx] for key, v in r.z.items()} if r.z is not None else None
+            self._routes[k] = r._from_arrays(x, y, zz, d)
+
+        return self._routes[k]
+
+
+    def get(self, tolerance=None, pixel_size=None):
+        """Get the simplest Route in the pyramid within the requested tolerance or pixel size.
+
+        Args:
+            tolerance (float, optional): maximum allowed deviation from the full resolution route.
+            pixel_size (float, optional): size of a screen pixel in route units. Used as the tolerance if tolerance is not given.
+
+        Returns:
+            Route: the simplified route.
+        """
+        return self.level(self.level_for(tolerance, pixel_size))
+
+
+    def save(self, path):
+        """Save the pyramid index arrays to a .npz file, to be stored alongside the route.
+
+        Args:
+            path (str): file path.
+        """
+        sizes = np.array([len(idx) for idx in self.indexes])
+        np.savez(path, indexes=np.concatenate(self.indexes[1:] or [np.zeros(0, dtype=np.int64)]), sizes=sizes,
+                 min_tolerance=self.min_tolerance)
+
+
+    @classmethod
+    def load(cls, path, route):
+        """Load a pyramid saved with save.
+
+        Args:
+            path (str): file path.
+            route (Route): the full resolution route the pyramid was built for.
+
+        Returns:
+            LevelOfDetail: Return a new LevelOfDetail object.
+        """
+        with np.load(path) as data:
+            sizes = data['sizes']
+            if sizes[0] != route.nr_points():
+                raise ValueError("Saved level of detail does not match the number of points of the route")
+            indexes = [np.arange(route.nr_points())]
+            if len(sizes) > 1:
+                indexes += np.split(data['indexes'], np.cumsum(sizes[1:-1]))
+            return cls(route, indexes, data['min_tolerance'])
@@ -0,0 +1,229 @@
+''' Routely map matching '''
+
+import numpy as np
+
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from .index import RouteIndex
+from .routely import Route
+
+
+class RoadGraph:
+    """
+    Create a road graph for map matching, from arrays of node coordinates and edges between them. Edges are straight segments and are treated as two-way. The segments are held in a RouteIndex for candidate search.
+
+    Args:
+        nodes (array-like) : (n, 2) array of node (x, y) coordinates.
+
+        edges (array-like) : (m, 2) array of node index pairs, one row per road segment.
+    """
+
+    def __init__(self, nodes, edges):
+
+        self.nodes = np.asarray(nodes, dtype=float).reshape(-1, 2)
+        self.edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+
+        if len(self.edges) == 0:
+            raise ValueError("Road graph must contain at least one edge")
+
+        if self.edges.min() < 0 or self.edges.max() >= len(self.nodes):
+            raise ValueError("Edges must refer to node indexes within 'nodes'")
+
+        a = self.nodes[self.edges[:, 0]]
+        b = self.nodes[self.edges[:, 1]]
+        self.lengths = np.hypot(*(b - a).T)
+
+        boxes = np.hstack((np.minimum(a, b), np.maximum(a, b)))
+        self.index = RouteIndex(boxes)
+
+
+    @classmethod
+    def load(cls, path):
+        """Load a road graph from a .npz file containing 'nodes' and 'edges' arrays.
+
+        Args:
+            path (str): file path.
+
+        Returns:
+            RoadGraph: Return a new RoadGraph object.
+        """
+        with np.load(path) as data:
+            return cls(data['nodes'], data['edges'])
+
+
+    def save(self, path):
+        """Save the road graph to a .npz file that can be read by load.
+
+        Args:
+            path (str): file path.
+        """
+        np.savez(path, nodes=self.nodes, edges=self.edges)
+
+
+    def candidates(self, x, y, radius, max_candidates=8):
+        """Find the road segments within a radius of each point and the nearest position on each.
+
+        Args:
+            x (array): 1d array of point x-coordinates.
+            y (array): 1d array of point y-coordinates.
+            radius (float): search radius about each point.
+            max_candidates (int, optional): keep at most this many of the nearest segments per point. Defaults to 8.
+
+        Returns:
+            tuple: (point, edge, offset, px, py, dist) 1d arrays with one entry per candidate, sorted by point then distance. offset is the distance along the edge from its first node to the projected position (px, py), and dist is the distance from the point to that position.
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+
+        boxes = np.stack((x - radius, y - radius, x + radius, y + radius), axis=1)
+        found = self.index.query_many(boxes)
+        point = np.repeat(np.arange(len(x)), [len(f) for f in found])
+        edge = np.concatenate(found).astype(np.int64) if found else np.zeros(0, dtype=np.int64)
+
+        # project each point onto each candidate segment
+        a = self.nodes[self.edges[edge, 0]]
+        b = self.nodes[self.edges[edge, 1]]
+        ab = b - a
+        length = self.lengths[edge]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = ((x[point] - a[:, 0])*ab[:, 0] + (y[point] - a[:, 1])*ab[:, 1])/length**2
+        t = np.clip(np.nan_to_num(t), 0, 1)
+        offset = t*length
+        px = a[:, 0] + t*ab[:, 0]
+        py = a[:, 1] + t*ab[:, 1]
+        dist = np.hypot(x[point] - px, y[point] - py)
+
+        # keep the nearest candidates within the radius
+        keep = dist <= radius
+        order = np.lexsort((dist[keep], point[keep]))
+        point, edge, offset, px, py, dist = (v[keep][order] for v in (point, edge, offset, px, py, dist))
+
+        starts = np.searchsorted(point, point, side='left')
+        keep = np.arange(len(point)) - starts < max_candidates
+
+        return point[keep], edge[keep], offset[keep], px[keep], py[keep], dist[keep]
+
+
+    def _subgraph(self, edges):
+        """Build a sparse adjacency matrix over the given edges, with nodes relabelled from 0.
+
+        Returns:
+            tuple: (csr_matrix, nodes) where nodes is the sorted array of original node indexes, so that np.searchsorted(nodes, i) gives the subgraph index of node i.
+        """
+        nodes, labels = np.unique(self.edges[edges], return_inverse=True)
+        labels = labels.reshape(-1, 2)
+
+        # csr_matrix adds up duplicate entries, so keep only the shortest edge between each pair of nodes
+        a, b = labels.min(axis=1), labels.max(axis=1)
+        lengths = self.lengths[edges]
+        order = np.lexsort((lengths, b, a))
+        a, b, lengths = a[order], b[order], lengths[order]
+        first = np.r_[True, (np.diff(a) != 0) | (np.diff(b) != 0)]
+
+        graph = csr_matrix((lengths[first], (a[first], b[first])), shape=(len(nodes), len(nodes)))
+        return graph, nodes
+
+
+def match(route, graph, radius=50., sigma=5., beta=5., max_candidates=8, max_detour=4., block_size=64, return_edges=False):
+    """Snap a route to a road graph with Hidden Markov Model map matching.
+
+    Candidate positions for each route point are the nearest positions on road segments within radius. Each candidate is scored by the distance from the point (Gaussian emission probability with standard deviation sigma), and each move between candidates of consecutive points by how much the road distance differs from the straight line distance between the points (exponential transition probability with scale beta). The most likely sequence of candidates is found with the Viterbi algorithm. Road distances come from Dijkstra shortest paths on the part of the graph around the route, calculated for blocks of points at a time.
+
+    Points with no candidate within radius are dropped. If no road path links consecutive points within max_detour times their straight line distance, matching restarts from the next point.
+
+    Args:
+        route (Route): route to match.
+        graph (RoadGraph): road graph to match to.
+        radius (float, optional): search radius for candidate positions. Defaults to 50.
+        sigma (float, optional): standard deviation of the position error of route points. Defaults to 5.
+        beta (float, optional): scale of the difference between road and straight line distances. Defaults to 5.
+        max_candidates (int, optional): maximum number of candidate positions per point. Defaults to 8.
+        max_detour (float, optional): road distances longer than this multiple of the straight line distance (plus twice the radius) are treated as unreachable. Defaults to 4.
+        block_size (int, optional): number of points per shortest path calculation, which bounds memory use. Defaults to 64.
+        return_edges (bool, optional): If True, also return the matched edge index of each point. Defaults to False.
+
+    Returns:
+        Route: Return a new Route object with the matched positions and the z data of the matched points. If return_edges, a tuple of (Route, edge indexes).
+    """
+    point, edge, offset, px, py, dist = graph.candidates(route.x, route.y, radius, max_candidates)
+
+    # steps of the HMM are the points with at least one candidate
+    steps, starts = np.unique(point, return_index=True)
+    if len(steps) < 2:
+        raise ValueError("Fewer than two route points are within 'radius' of the road graph")
+    ends = np.append(starts[1:], len(point))
+
+    emission = -0.5*(dist/sigma)**2
+    straight = np.hypot(np.diff(route.x[steps]), np.diff(route.y[steps]))
+
+    # shortest paths are only needed on the roads around the route
+    (xmin, ymin), (xmax, ymax) = route.bbox()
+    margin = radius + max_detour*straight.max()
+    local = graph.index.query(((xmin - margin, ymin - margin), (xmax + margin, ymax + margin)))
+    sub, nodes = graph._subgraph(local)
+
+    u = np.searchsorted(nodes, graph.edges[edge, 0])
+    v = np.searchsorted(nodes, graph.edges[edge, 1])
+    to_u = offset
+    to_v = graph.lengths[edge] - offset
+
+    score = emission[starts[0]:ends[0]]
+    scores = [score]
+    back = []
+
+    for block in range(0, len(steps) - 1, block_size):
+        last = min(block + block_size, len(steps) - 1)
+        lo, hi = starts[block], ends[last]
+        limit = max_detour*straight[block:last].max() + 2*radius
+
+        sources = np.unique(np.concatenate((u[lo:hi], v[lo:hi])))
+        paths = dijkstra(sub, directed=False, indices=sources, limit=limit)
+        row = np.full(sub.shape[0], -1, dtype=np.int64)
+        row[sources] = np.arange(len(sources))
+
+        for t in range(block, last):
+            i = np.s_[starts[t]:ends[t]]
+            j = np.s_[starts[t + 1]:ends[t + 1]]
+
+            # road distance between every pair of candidates, via either end of each segment
+            road = np.full((ends[t] - starts[t], ends[t + 1] - starts[t + 1]), np.inf)
+            for a_node, a_dist in ((u[i], to_u[i]), (v[i], to_v[i])):
+                for b_node, b_dist in ((u[j], to_u[j]), (v[j], to_v[j])):
+                    via = a_dist[:, None] + paths[row[a_node]][:, b_node] + b_dist[None, :]
+                    road = np.minimum(road, via)
+
+            same = edge[i][:, None] == edge[j][None, :]
+            road = np.where(same, np.abs(offset[i][:, None] - offset[j][None, :]), road)
+
+            with np.errstate(invalid='ignore'):
+                transition = -np.abs(road - straight[t])/beta
+            transition[road > limit] = -np.inf
+
+            total = score[:, None] + transition
+            best = total.argmax(axis=0)
+            new = total[best, np.arange(total.shape[1])]
+
+            if np.isneginf(new).all():
+                # no route between the points, start a new chain
+                best[:] = -1
+                new = np.zeros(total.shape[1])
+
+            score = new + emission[j]
+            scores.append(score)
+            back.append(best)
+
+    # backtrack, jumping to the best end of the previous chain at each restart
+    chosen = np.empty(len(steps), dtype=np.int64)
+    chosen[-1] = scores[-1].argmax()
+    for t in range(len(steps) - 1, 0, -1):
+        prev = back[t - 1][chosen[t]]
+        chosen[t - 1] = prev if prev >= 0 else scores[t - 1].argmax()
+
+    idx = starts + chosen
+    zz = {k: values[steps] for k, values in route.z.items()} if route.z is not None else None
+    matched = Route(px[idx], py[idx], z=zz)
+
+    if return_edges:
+        return matched, edge[idx]
+    return matched
@@ -0,0 +1,237 @@
+''' Routely memory profiling '''
+
+import gc
+import linecache
+import os
+import sys
+import sysconfig
+import threading
+import tracemalloc
+
+
+# Number of frames recorded per allocation, so allocations inside libraries are traced back to the calling line
+_NR_FRAMES = 10
+
+_PACKAGE_PATH = os.path.dirname(os.path.abspath(__file__))
+_LIBRARY_PATHS = tuple({os.path.abspath(sysconfig.get_paths()[k]) for k in ('stdlib', 'platstdlib', 'purelib', 'platlib')})
+
+
+class AllocationReport:
+    """
+    Memory allocated by a function call, as measured by measure().
+
+    Attributes:
+        name (str) : Name of the measured call.
+
+        nr_points (int) : Number of input points, used for per point figures.
+
+        peak (int) : Peak bytes allocated during the call, above the memory in use before it.
+
+        retained (int) : Bytes still allocated after the call, including the returned result.
+
+        lines (list) : (file, line number, bytes, count) of the largest retained allocations.
+
+        peak_lines (list) : (file, line number, bytes, count) of the largest allocations held at the peak, or None if they were not traced.
+    """
+
+    def __init__(self, name, nr_points, peak, retained, lines, peak_lines=None):
+
+        self.name = name
+        self.nr_points = nr_points
+        self.peak = peak
+        self.retained = retained
+        self.lines = lines
+        self.peak_lines = peak_lines
+
+
+    def peak_per_point(self):
+        return self.peak/max(self.nr_points, 1)
+
+
+    def retained_per_point(self):
+        return self.retained/max(self.nr_points, 1)
+
+
+    @staticmethod
+    def _format_lines(lines):
+        out = []
+        for filename, lineno, size, count in lines:
+            code = linecache.getline(filename, lineno).strip()
+            out.append(f'    {size:>12,d} B in {count:>4d} blocks  {filename}:{lineno}  {code}')
+        return out
+
+
+    def __str__(self):
+        out = [
+            f'{self.name} with {self.nr_points} points:',
+            f'  peak     {self.peak:>12,d} B ({self.peak_per_point():,.1f} B/point)',
+            f'  retained {self.retained:>12,d} B ({self.retained_per_point():,.1f} B/point)',
+        ]
+        if self.peak_lines is not None:
+            out.append('  largest allocations at peak:')
+            out += self._format_lines(self.peak_lines)
+        out.append('  largest retained allocations:')
+        out += self._format_lines(self.lines)
+
+        return '\n'.join(out)
+
+
+def _caller_frame(traceback):
+    """Get the innermost frame of a traceback in routely or user code, rather than in the standard library or installed packages.
+    """
+    for frame in reversed(traceback):
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(_PACKAGE_PATH) or not filename.startswith(_LIBRARY_PATHS):
+            return frame
+    return traceback[-1]
+
+
+def _top_lines(snapshot, top):
+    """Get the largest allocations of a snapshot as (file, line number, bytes, count), grouped by the calling line in routely or user code.
+    """
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+
+    totals = {}
+    for stat in snapshot.statistics('traceback'):
+        frame = _caller_frame(stat.traceback)
+        size, count = totals.get((frame.filename, frame.lineno), (0, 0))
+        totals[(frame.filename, frame.lineno)] = (size + stat.size, count + stat.count)
+
+    lines = sorted(totals.items(), key=lambda item: -item[1][0])[:top]
+    return [(filename, lineno, size, count) for (filename, lineno), (size, count) in lines]
+
+
+def peak_lines(fn, *args, top=10, **kwargs):
+    """Find the lines responsible for the peak memory of calling fn(*args, **kwargs). A snapshot is taken each time the traced memory reaches a new high, checked on every function call and return, and the allocations in the last snapshot are reported. Allocations within a single call into compiled code are seen only as far as they are still held when it returns.
+
+    fn is called once more than by measure(), since the profiling hook and snapshots would otherwise add to the measured figures.
+
+    Args:
+        fn (function): function to call.
+        *args: positional arguments passed to fn.
+        top (int, optional): number of source lines to return. Defaults to 10.
+        **kwargs: keyword arguments passed to fn.
+
+    Returns:
+        list: (file, line number, bytes, count) of the largest allocations held at the peak.
+    """
+    state = {'high': 0, 'overhead': 0, 'snapshot': None}
+
+    def profile(frame, event, arg):
+        current = tracemalloc.get_traced_memory()[0] - state['overhead']
+        if current > state['high'] + max(65536, state['high']//100):
+            # drop the previous snapshot before taking the next, and discount the memory the snapshot holds
+            state['snapshot'] = None
+            before = tracemalloc.get_traced_memory()[0]
+            state['snapshot'] = tracemalloc.take_snapshot()
+            state['overhead'] = tracemalloc.get_traced_memory()[0] - before
+            state['high'] = current
+
+    _run_traced(fn, args, kwargs, profile)
+    snapshot = state['snapshot']
+    if snapshot is None:
+        return []
+
+    return _top_lines(snapshot, top)
+
+
+def _run_traced(fn, args, kwargs, profile=None):
+    """Call fn with tracemalloc running, and return (result, memory before, current memory after, peak memory, snapshot after).
+    """
+    was_tracing = tracemalloc.is_tracing()
+    if was_tracing:
+        tracemalloc.stop()
+
+    gc.collect()
+    tracemalloc.start(_NR_FRAMES)
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        if profile is not None:
+            threading.setprofile(profile)
+            sys.setprofile(profile)
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            if profile is not None:
+                sys.setprofile(None)
+                threading.setprofile(None)
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+        if was_tracing:
+            tracemalloc.start()
+
+    return result, before, current, peak, snapshot
+
+
+def measure(fn, *args, name=None, nr_points=0, top=10, trace_peak=False, **kwargs):
+    """Measure the memory allocated by calling fn(*args, **kwargs) using tracemalloc. NumPy reports its array allocations to tracemalloc, so array data is included. Allocations are attributed to the innermost calling line in routely or user code.
+
+    Args:
+        fn (function): function to call.
+        *args: positional arguments passed to fn.
+        name (str, optional): name for the report. Defaults to the function name.
+        nr_points (int, optional): number of input points, used for per point figures. Defaults to 0.
+        top (int, optional): number of source lines to include in the report. Defaults to 10.
+        trace_peak (bool, optional): If True, also report the lines responsible for the peak, see peak_lines(). This calls fn a second time. Defaults to False.
+        **kwargs: keyword arguments passed to fn.
+
+    Returns:
+        tuple: (result of fn, AllocationReport)
+    """
+    result, before, current, peak, snapshot = _run_traced(fn, args, kwargs)
+
+    report = AllocationReport(
+        name or getattr(fn, '__qualname__', repr(fn)),
+        nr_points,
+        peak - before,
+        current - before,
+        _top_lines(snapshot, top),
+        peak_lines(fn, *args, top=top, **kwargs) if trace_peak else None,
+    )
+
+    return result, report
+
+
+def check_budget(fn, make_input, sizes, peak_per_point, retained_per_point=None, fixed_bytes=0, name=None):
+    """Assert that a function stays within a memory budget across input sizes. The budget at n points is per_point * n + fixed_bytes, for both peak and retained allocations.
+
+    Args:
+        fn (function): function to check, taking the input as its only argument.
+        make_input (function): creates the input for a number of points. Input creation is not measured.
+        sizes (list): numbers of input points to check.
+        peak_per_point (float): peak bytes allowed per input point.
+        retained_per_point (float, optional): retained bytes allowed per input point. Defaults to None, which does not check retained allocations.
+        fixed_bytes (int, optional): bytes allowed regardless of input size, for fixed size outputs or overheads. Defaults to 0.
+        name (str, optional): name for the report. Defaults to the function name.
+
+    Returns:
+        list: AllocationReport for each size.
+
+    Raises:
+        AssertionError: if any size is over budget, with the allocation report of that size including the lines responsible for the peak.
+    """
+    reports = []
+    for n in sizes:
+        data = make_input(n)
+        result, report = measure(fn, data, name=name, nr_points=n)
+        del result
+        reports.append(report)
+
+        failures = []
+        if report.peak > peak_per_point*n + fixed_bytes:
+            failures.append(f'peak over budget of {peak_per_point} B/point + {fixed_bytes} B')
+        if retained_per_point is not None and report.retained > retained_per_point*n + fixed_bytes:
+            failures.append(f'retained over budget of {retained_per_point} B/point + {fixed_bytes} B')
+
+        if failures:
+            # run again to find where the peak came from
+            report.peak_lines = peak_lines(fn, data)
+            raise AssertionError('\n'.join(failures) + '\n' + str(report))
+
+    return reports
@@ -3,12 +3,41 @@
 import math
 import copy
 
+from concurrent.futures import ThreadPoolExecutor
+
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
 from matplotlib.ticker import MultipleLocator
-from scipy.interpolate import interp1d
+from scipy.interpolate import make_interp_spline
+
+from . import codec
+from .arclength import ArcLength
+from .cache import content_hash, memoized
+from .lod import LevelOfDetail
+
+
+def _import_pyarrow():
+    """Import pyarrow, which is an optional dependency.
+    """
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError("pyarrow is required for Arrow support, install it with 'pip install pyarrow'") from e
+    return pyarrow
+
+
+def _as_route_dtype(values):
+    """Cast numeric arrays that are not int64 or float64, such as float32 or int32 columns, to the dtypes a Route accepts. Arrays already of an accepted dtype are returned without copying.
+    """
+    if values.dtype in (np.int64, np.float64):
+        return values
+    if np.issubdtype(values.dtype, np.integer):
+        return values.astype(np.int64)
+    if np.issubdtype(values.dtype, np.floating):
+        return values.astype(np.float64)
+    return values
 
 
 class Route:
@@ -21,34 +50,38 @@ class Route:
         y (array-like) : List or array of y-coordinates of the route.
 
         z (dict, optional) : List or array of z data for the route. This does not need to be elevation, but any data corresponding to the route in the x-y plane. Defaults to None.
+
+        copy (bool, optional) : If True, input arrays are always copied. If False, numpy array inputs are wrapped without copying and will share memory with the caller. Defaults to True.
     """
 
-    def __init__(self, x, y, z=None):
+    def __init__(self, x, y, z=None, copy=True):
 
         self.x = x
         self.y = y
         self.z = z
 
-        self._prep_inputs()
+        self._prep_inputs(copy=copy)
         self._check_inputlengths()
         self._check_inputvalues()
 
         self.d = self._calculate_distance()
 
 
-    def _prep_inputs(self):
+    def _prep_inputs(self, copy=True):
         """
-        Convert args to array if not none.
+        Convert args to array if not none. If copy is False, existing arrays are used as they are.
         """
+        to_array = np.array if copy else np.asarray
+
         if self.x is not None:
-            self.x = np.array(self.x)
+            self.x = to_array(self.x)
 
         if self.y is not None:
-            self.y = np.array(self.y)
+            self.y = to_array(self.y)
 
         if self.z is not None:
             for k in self.z.keys():
-                self.z[k] = np.array(self.z[k])
+                self.z[k] = to_array(self.z[k])
 
 
     def _check_inputlengths(self):
@@ -92,20 +125,134 @@ class Route:
 
 
     def copy(self):
-        return copy.copy(self)
+        r = copy.copy(self)
+        # derived values are cached per Route, so the copy starts without them
+        r.__dict__.pop('_cached', None)
+        return r
+
+
+    @classmethod
+    def _from_arrays(cls, x, y, z, d):
+        """Create a Route directly from prepared arrays with a known cumulative distance, skipping input checks and the distance calculation. Arrays are used as they are, without copying.
+        """
+        r = cls.__new__(cls)
+        r.x = x
+        r.y = y
+        r.z = z
+        r.d = d
+        return r
 
 
-    def dataframe(self):
+    def _columns(self):
         """
-        Returns route data in list form -> [(x, y, z, distance)]. z will be included if specified as an input arguement.
+        Returns route data as a dict of column name to array -> {x, y, d, z...}.
         """
-        df = pd.DataFrame({'x':self.x, 'y':self.y, 'd':self.d})
+        columns = {'x':self.x, 'y':self.y, 'd':self.d}
 
         if self.z is not None:
-            for k, v in self.z.items():
-                df[k] = v
+            columns.update(self.z)
+
+        return columns
+
+
+    def dataframe(self, copy=True):
+        """
+        Returns route data as a DataFrame with columns x, y, d and z. z will be included if specified as an input arguement.
+
+        Args:
+            copy (bool, optional): If True, the route data is copied into the DataFrame in one block per dtype. If False, the DataFrame columns are views of the Route arrays and no data is copied. Defaults to True.
+
+        Returns:
+            DataFrame: route data.
+        """
+        return pd.DataFrame(self._columns(), copy=copy)
+
+
+    @classmethod
+    def from_dataframe(cls, df, x='x', y='y', z=None):
+        """Create a Route from the columns of a DataFrame. Column data is wrapped without copying where the column dtypes allow, and other numeric columns such as float32 are copied to int64 or float64.
+
+        Args:
+            df (DataFrame): DataFrame of route data.
+            x (str, optional): name of the x-coordinate column. Defaults to 'x'.
+            y (str, optional): name of the y-coordinate column. Defaults to 'y'.
+            z (list, optional): names of the z data columns. If None, all columns other than x, y and 'd' are used. Defaults to None.
+
+        Returns:
+            Route: Return a new Route object.
+        """
+        if z is None:
+            z = [c for c in df.columns if c not in (x, y, 'd')]
+
+        zz = {k: _as_route_dtype(df[k].to_numpy()) for k in z} if len(z) > 0 else None
+
+        return cls(_as_route_dtype(df[x].to_numpy()), _as_route_dtype(df[y].to_numpy()), z=zz, copy=False)
+
+
+    def to_arrow(self):
+        """
+        Returns route data as a pyarrow Table with columns x, y, d and z. Numeric arrays are passed to Arrow without copying. Requires pyarrow.
+
+        Returns:
+            Table: route data.
+        """
+        pa = _import_pyarrow()
+        return pa.table(self._columns())
+
+
+    @classmethod
+    def from_arrow(cls, table, x='x', y='y', z=None):
+        """Create a Route from the columns of a pyarrow Table. Single chunk int64 and float64 columns without nulls are wrapped without copying, and other numeric columns such as float32 are copied to int64 or float64. Requires pyarrow.
+
+        Args:
+            table (Table): pyarrow Table of route data.
+            x (str, optional): name of the x-coordinate column. Defaults to 'x'.
+            y (str, optional): name of the y-coordinate column. Defaults to 'y'.
+            z (list, optional): names of the z data columns. If None, all columns other than x, y and 'd' are used. Defaults to None.
+
+        Returns:
+            Route: Return a new Route object.
+        """
+        _import_pyarrow()
+
+        def to_numpy(name):
+            column = table.column(name)
+            if column.num_chunks == 1:
+                return _as_route_dtype(column.chunk(0).to_numpy(zero_copy_only=False))
+            return _as_route_dtype(column.to_numpy())
+
+        if z is None:
+            z = [c for c in table.column_names if c not in (x, y, 'd')]
+
+        zz = {k: to_numpy(k) for k in z} if len(z) > 0 else None
+
+        return cls(to_numpy(x), to_numpy(y), z=zz, copy=False)
 
-        return df
+
+    def to_bytes(self, precision=5):
+        """Encode the route into a compact byte string. Float data is quantized to the given number of decimal places, delta encoded between consecutive points and written as zigzag varints, similar to Google's encoded polyline format but for x, y and each z channel. Int data is stored exactly. Distance is not stored and is recalculated by from_bytes.
+
+        Args:
+            precision (int, optional): number of decimal places retained for float data. Defaults to 5.
+
+        Returns:
+            bytes: the encoded route.
+        """
+        return codec.encode_route(self.x, self.y, self.z, precision)
+
+
+    @classmethod
+    def from_bytes(cls, buffer):
+        """Create a Route from a byte string produced by to_bytes.
+
+        Args:
+            buffer (bytes): the encoded route.
+
+        Returns:
+            Route: Return a new Route object.
+        """
+        x, y, z = codec.decode_route(buffer)
+        return cls(x, y, z=z)
 
 
     def bbox(self):
@@ -165,12 +312,306 @@ class Route:
         """
         return len(self.x)
 
-    # TODO: close off the route
-    # def close_off_route(self):
-    #     """Close off the route by ensuring the first and last coordinates are equal.
-    #     """
 
-    #     return
+    def _cache(self):
+        """Get the dict of derived values cached on the Route.
+        """
+        return self.__dict__.setdefault('_cached', {})
+
+
+    def content_hash(self):
+        """Get a stable hash of the route content over x, y and z data, including dtypes. Used as the key for memoized Route methods, see routely.cache.enable_cache(). The hash is calculated on every call, so it always reflects the current route data.
+
+        Returns:
+            str: hex digest.
+        """
+        return content_hash(self)
+
+
+    @staticmethod
+    def _wrap_angle(angle_deg):
+        """Wrap angles in degrees to the range [-180, 180).
+        """
+        return (angle_deg + 180.) % 360. - 180.
+
+
+    def heading(self):
+        """Get the heading at each coordinate point, being the direction of travel to the next point in degrees counterclockwise from the positive x-axis. The last point takes the heading of the final segment, and zero length segments take the heading of the previous segment. The result is cached on the Route.
+
+        Returns:
+            array: 1d array of headings in degrees, in the range [-180, 180).
+        """
+        cache = self._cache()
+        if 'heading' not in cache:
+            dx = np.diff(self.x.astype(float))
+            dy = np.diff(self.y.astype(float))
+            seg = self._wrap_angle(np.degrees(np.arctan2(dy, dx)))
+
+            # carry the last known heading over zero length segments
+            valid = (dx != 0) | (dy != 0)
+            if valid.any():
+                idx = np.where(valid, np.arange(len(seg)), 0)
+                idx[:valid.argmax()] = valid.argmax()
+                seg = seg[np.maximum.accumulate(idx)]
+
+            cache['heading'] = np.append(seg, seg[-1])
+
+        return cache['heading']
+
+
+    def _turning(self):
+        """Get the signed change in heading at each coordinate point in degrees, positive counterclockwise. End points have no turn. The result is cached on the Route.
+        """
+        cache = self._cache()
+        if 'turning' not in cache:
+            h = self.heading()
+            turning = np.zeros(len(h))
+            turning[1:-1] = self._wrap_angle(np.diff(h[:-1]))
+            cache['turning'] = turning
+
+        return cache['turning']
+
+
+    def curvature(self):
+        """Get the signed curvature at each coordinate point, estimated as the change in heading (in radians) divided by the mean length of the adjoining segments. Positive curvature turns counterclockwise (left). End points have zero curvature. The result is cached on the Route.
+
+        Returns:
+            array: 1d array of curvature, in units of 1/distance.
+        """
+        cache = self._cache()
+        if 'curvature' not in cache:
+            seg = np.diff(self.d)
+            ds = np.zeros(len(self.d))
+            ds[1:-1] = (seg[:-1] + seg[1:])/2.
+
+            with np.errstate(invalid='ignore', divide='ignore'):
+                k = np.radians(self._turning())/ds
+            cache['curvature'] = np.where(ds > 0, k, 0.)
+
+        return cache['curvature']
+
+
+    def detect_turns(self, min_angle=45, min_distance=0):
+        """Detect turns along the route, being places where the heading changes by at least min_angle within min_distance along the route. Consecutive points meeting the threshold in the same direction are reported as a single turn at the point of sharpest heading change.
+
+        With min_distance of 0, only the heading change at each individual point is considered. Increase min_distance to detect turns made gradually over several points, for example hairpins in densely sampled routes.
+
+        Args:
+            min_angle (float, optional): minimum change in heading in degrees. Defaults to 45.
+            min_distance (float, optional): distance along the route over which the heading change is measured, centered on each point. Defaults to 0.
+
+        Returns:
+            DataFrame: one row per turn with columns 'index', 'x', 'y', 'd', 'angle' (signed heading change in degrees, positive counterclockwise) and 'direction' ('left' or 'right').
+        """
+        turning = self._turning()
+
+        if min_distance > 0:
+            # unwrapped heading as a function of distance, differenced across each window
+            h = np.cumsum(turning)
+            change = (np.interp(self.d + min_distance/2., self.d, h) -
+                      np.interp(self.d - min_distance/2., self.d, h))
+        else:
+            change = turning
+
+        sign = np.sign(change) * (np.abs(change) >= min_angle)
+
+        # runs of consecutive points turning the same way, numbered from the start of each run
+        in_run = np.flatnonzero(sign)
+        run_id = np.cumsum(np.diff(np.concatenate(([0], sign))) != 0)[in_run]
+        run_start = np.flatnonzero(np.diff(np.concatenate(([-1], run_id))) != 0)
+
+        # sharpest point of each run, the first one on ties
+        size = np.abs(change[in_run])
+        sharpest = np.flatnonzero(size == np.repeat(np.maximum.reduceat(size, run_start), np.diff(np.append(run_start, len(size)))))
+        sharpest = sharpest[np.diff(np.concatenate(([-1], run_id[sharpest]))) != 0]
+        idx = in_run[sharpest]
+        angle = change[idx]
+
+        return pd.DataFrame({
+            'index': idx,
+            'x': self.x[idx],
+            'y': self.y[idx],
+            'd': self.d[idx],
+            'angle': angle,
+            'direction': np.where(angle > 0, 'left', 'right'),
+        })
+
+
+    def _transform_cache(self, route, heading_fn, flip):
+        """Carry cached heading, turning and curvature over to a rotated or mirrored Route.
+
+        Args:
+            route (Route): the transformed Route.
+            heading_fn (function): maps headings of this Route onto headings of the transformed Route.
+            flip (bool): If True, the transformation is a reflection which reverses the direction of turns.
+        """
+        cache = self._cache()
+        new = route._cache()
+        sign = -1. if flip else 1.
+
+        if 'heading' in cache:
+            new['heading'] = self._wrap_angle(heading_fn(cache['heading']))
+        if 'turning' in cache:
+            new['turning'] = sign * cache['turning']
+        if 'curvature' in cache:
+            new['curvature'] = sign * cache['curvature']
+
+        return route
+
+
+    def is_closed(self):
+        """Check whether the first and last coordinates of the route are equal.
+
+        Returns:
+            bool: True if the route is closed.
+        """
+        return self.x[0] == self.x[-1] and self.y[0] == self.y[-1]
+
+
+    def close_off_route(self):
+        """Close off the route by ensuring the first and last coordinates are equal. If the route is not already closed, the first point (and its z data) is appended to the end of the route.
+
+        Returns:
+            Route: Return a new Route object.
+        """
+        if self.is_closed():
+            return self.copy()
+
+        x = np.append(self.x, self.x[0])
+        y = np.append(self.y, self.y[0])
+        d = np.append(self.d, self.d[-1] + math.hypot(self.x[0] - self.x[-1], self.y[0] - self.y[-1]))
+
+        if self.z is not None:
+            zz = {k: np.append(v, v[0]) for k, v in self.z.items()}
+        else:
+            zz = None
+
+        return Route._from_arrays(x, y, zz, d)
+
+
+    def _shoelace(self):
+        """Get the signed area of the polygon formed by the route, and the terms of the shoelace sum. The route is treated as closed.
+        """
+        x = self.x.astype(float)
+        y = self.y.astype(float)
+        x1, y1 = np.roll(x, -1), np.roll(y, -1)
+        cross = x*y1 - x1*y
+        return cross.sum()/2., cross
+
+
+    def area(self, signed=False):
+        """Get the area enclosed by the route using the shoelace formula. The route is treated as closed, ie the last point joins back to the first.
+
+        Args:
+            signed (bool, optional): If True, the area is positive for counterclockwise routes and negative for clockwise routes. Defaults to False.
+
+        Returns:
+            float: enclosed area.
+        """
+        a, _ = self._shoelace()
+        return a if signed else abs(a)
+
+
+    def centroid(self):
+        """Get the centroid of the area enclosed by the route. The route is treated as closed. Unlike center(), which is the mid-point of the route extents, this is the geometric center of the enclosed area.
+
+        Returns:
+            tuple: (x, y) coordinates of the centroid.
+        """
+        a, cross = self._shoelace()
+        if a == 0:
+            raise ValueError("Route encloses no area, so the centroid is undefined")
+
+        x = self.x.astype(float)
+        y = self.y.astype(float)
+        cx = ((x + np.roll(x, -1))*cross).sum()/(6.*a)
+        cy = ((y + np.roll(y, -1))*cross).sum()/(6.*a)
+        return (cx, cy)
+
+
+    def _edge_bands(self):
+        """Build an index of the polygon edges by horizontal band so that a point only needs testing against the edges that span its y-coordinate. The edges are stored in compressed form, with the edges of band b at edges[offsets[b]:offsets[b + 1]]. The index is cached on the Route.
+        """
+        cache = self._cache()
+        if 'edge_bands' not in cache:
+            x1 = self.x.astype(float)
+            y1 = self.y.astype(float)
+            x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+
+            # horizontal edges never cross a horizontal ray
+            keep = y1 != y2
+            x1, y1, x2, y2 = x1[keep], y1[keep], x2[keep], y2[keep]
+
+            # one band per edge, but fewer when edges are tall, so that the index holds at most about 4 entries per edge
+            y0 = self.y.min()
+            height = self.height()
+            span = np.abs(y2 - y1).sum()
+            nr_bands = len(x1)
+            if span > 0:
+                nr_bands = min(nr_bands, int(2*len(x1)*height/span))
+            nr_bands = int(np.clip(nr_bands, 1, 65536))
+            band_height = max(height/nr_bands, np.finfo(float).tiny)
+
+            lo = np.clip(((np.minimum(y1, y2) - y0)/band_height).astype(int), 0, nr_bands - 1)
+            hi = np.clip(((np.maximum(y1, y2) - y0)/band_height).astype(int), 0, nr_bands - 1)
+
+            # repeat each edge for every band it spans
+            counts = hi - lo + 1
+            edge = np.repeat(np.arange(len(x1)), counts)
+            band = np.repeat(lo, counts) + np.arange(len(edge)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+            order = np.argsort(band, kind='stable')
+            offsets = np.concatenate(([0], np.cumsum(np.bincount(band, minlength=nr_bands))))
+
+            cache['edge_bands'] = {
+                'edges': np.stack((x1, y1, x2, y2), axis=1)[edge[order]],
+                'offsets': offsets,
+                'y0': y0,
+                'band_height': band_height,
+                'nr_bands': nr_bands,
+            }
+
+        return cache['edge_bands']
+
+
+    def contains(self, points, chunk_size=65536):
+        """Test whether points lie inside the area enclosed by the route, for example to test GPS fixes against a geofence. The route is treated as closed. Uses the crossing number (even-odd) rule, testing each point only against the edges in its horizontal band of a cached edge index. Points exactly on the boundary may be reported either way.
+
+        Args:
+            points (array-like): (x, y) points to test, as an (n, 2) array or list of tuples.
+            chunk_size (int, optional): number of points tested at a time, which bounds memory use. Defaults to 65536.
+
+        Returns:
+            array: 1d boolean array, True for points inside the route.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        inside = np.zeros(len(points), dtype=bool)
+
+        bands = self._edge_bands()
+        edges, offsets = bands['edges'], bands['offsets']
+        (xmin, ymin), (xmax, ymax) = self.bbox()
+
+        for start in range(0, len(points), chunk_size):
+            px = points[start:start + chunk_size, 0]
+            py = points[start:start + chunk_size, 1]
+
+            # only points within the route extents can be inside
+            candidates = np.flatnonzero((px >= xmin) & (px <= xmax) & (py >= ymin) & (py <= ymax))
+            b = np.clip(((py[candidates] - bands['y0'])/bands['band_height']).astype(int), 0, bands['nr_bands'] - 1)
+
+            # pair each candidate point with each edge in its band
+            counts = offsets[b + 1] - offsets[b]
+            point = np.repeat(candidates, counts)
+            edge = np.repeat(offsets[b], counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+            x1, y1, x2, y2 = edges[edge].T
+            qx, qy = px[point], py[point]
+            crosses = ((y1 > qy) != (y2 > qy)) & (qx < x1 + (qy - y1)*(x2 - x1)/(y2 - y1))
+
+            nr_crossings = np.bincount(point[crosses], minlength=len(px))
+            inside[start:start + chunk_size] = nr_crossings % 2 == 1
+
+        return inside
 
 
     def plotroute(self, markers=True, equal_aspect=True, equal_lims=True, canvas_style=False):
@@ -264,13 +705,11 @@ class Route:
         Returns:
             array: 1d array of cumulative distance from the start of the Route to the end.
         """
-        xy = list(zip(self.x, self.y))
+        dist = np.empty(len(self.x))
+        dist[0] = 0
+        np.cumsum(np.hypot(np.diff(self.x), np.diff(self.y)), out=dist[1:])
 
-        dist = [0]
-        for i in range(1, len(xy)):
-            dist.append(self.distance_between_two_points(xy[i-1], xy[i]))
-
-        return np.array(dist).cumsum()
+        return dist
 
 
     @staticmethod
@@ -296,36 +735,31 @@ class Route:
         Returns:
             Route: Return a new Route object.
         """
-        # idx_x = set(np.unique(self.x, return_index=True)[1])
-        # idx_y = set(np.unique(self.y, return_index=True)[1])
-        # idx = idx_x.intersection(idx_y)
         if duplicates == 'consecutive':
-            xy = list(zip(self.x, self.y))
-            idx = [0]
-            for i, p in list(enumerate(xy))[1:]:
-                if p != xy[i-1]:
-                    idx.append(i)
+            # keep the first point and each point that differs from the one before
+            idx = np.flatnonzero(np.r_[True, (np.diff(self.x) != 0) | (np.diff(self.y) != 0)])
 
         elif duplicates == 'any':
-            idx = set(np.unique(list(zip(self.x, self.y)), axis=0, return_index=True)[1])
+            # first occurrence of each unique point, in route order
+            idx = np.sort(np.unique(np.stack((self.x, self.y), axis=1), axis=0, return_index=True)[1])
 
         else:
             raise ValueError("'duplicates' arg not valid see docs for valid options")
 
-        new_x = self.x[list(idx)]
-        new_y = self.y[list(idx)]
+        new_x = self.x[idx]
+        new_y = self.y[idx]
 
         if self.z is not None:
-            # for each z, interpolate and add to the new dict
             zz = {}
             for k, v in self.z.items():
-                zz[k] = v[list(idx)]
+                zz[k] = v[idx]
         else:
             zz = None
 
         return Route(new_x, new_y, z=zz)
 
 
+    @memoized
     def interpolate(self, kind='equidistant_steps', num=1):
         """
         Interpolate Route x and y coordinate lists given various interpolation stategies.
@@ -356,12 +790,12 @@ class Route:
 
 
         if kind == 'equidistant_steps':
-            # New list of distance points to interpolate Route data against
-            dist = list(np.arange(d.min(), d.max()+num, step=num))
+            # New array of distance points to interpolate Route data against
+            dist = np.arange(d.min(), d.max()+num, step=num)
 
         elif kind == 'absolute_steps':
-            # New list of distance points to interpolate Route data against
-            dist = list(np.linspace(d.min(), d.max(), num=num))
+            # New array of distance points to interpolate Route data against
+            dist = np.linspace(d.min(), d.max(), num=num)
 
         # Interpolate x and y wrt to d against the new list of distanced points
         xx = np.interp(dist, d, x)
@@ -379,19 +813,270 @@ class Route:
 
         return Route(xx, yy, z=zz)
 
+
+    def _z_at(self, idx):
+        """Index every z array, returning None if there is no z data.
+        """
+        if self.z is None:
+            return None
+        return {k: v[idx] for k, v in self.z.items()}
+
+
+    def slice(self, d_start, d_end):
+        """Get the section of the Route between two distances along the route. End points are linearly interpolated where they fall between existing coordinates. If both distances coincide with existing coordinates, the new Route's x, y and z are views of this Route's arrays and no data is copied.
+
+        Args:
+            d_start (float): distance along the route at which the section starts.
+            d_end (float): distance along the route at which the section ends.
+
+        Returns:
+            Route: Return a new Route object. Distance is measured from the start of the section.
+        """
+        d = self.d
+        d_start = max(d_start, d[0])
+        d_end = min(d_end, d[-1])
+
+        if not d_end > d_start:
+            raise ValueError("'d_end' must be greater than 'd_start' and the section must overlap the route")
+
+        # first coordinate at or after the start, last coordinate at or before the end
+        i0 = np.searchsorted(d, d_start, side='left')
+        i1 = np.searchsorted(d, d_end, side='right') - 1
+
+        if d[i0] == d_start and d[i1] == d_end:
+            idx = np.s_[i0:i1 + 1]
+            return Route._from_arrays(self.x[idx], self.y[idx], self._z_at(idx), d[idx] - d_start)
+
+        # interior coordinates strictly between the end points
+        j0 = i0 + 1 if d[i0] == d_start else i0
+        j1 = i1 if d[i1] == d_end else i1 + 1
+
+        def section(v):
+            ends = np.interp([d_start, d_end], d, v)
+            return np.concatenate(([ends[0]], v[j0:j1], [ends[1]]))
+
+        x, y = section(self.x), section(self.y)
+        zz = {k: section(v) for k, v in self.z.items()} if self.z is not None else None
+
+        return Route._from_arrays(x, y, zz, section(d) - d_start)
+
+
+    def split_every(self, distance):
+        """Split the Route into consecutive sections of equal distance along the route, for example laps or kilometres. The final section holds the remainder. Split points are linearly interpolated and shared by the sections either side.
+
+        All split points are inserted in a single pass, and the x, y and z data of each section are views into the resulting arrays.
+
+        Args:
+            distance (float): distance along the route covered by each section.
+
+        Returns:
+            list: list of Route objects. Distance is measured from the start of each section.
+        """
+        if not distance > 0:
+            raise ValueError("'distance' must be greater than 0")
+
+        d = self.d
+        splits = np.arange(d[0], d[-1], distance)[1:]
+
+        # Insert the split points that do not coincide with existing coordinates
+        idx = np.searchsorted(d, splits, side='left')
+        new = d[idx] != splits
+        pos = idx + np.cumsum(new) - new
+
+        def merge(v):
+            return np.insert(v.astype(float, copy=False), idx[new], np.interp(splits[new], d, v))
+
+        x, y, dd = merge(self.x), merge(self.y), merge(d)
+        zz = {k: merge(v) for k, v in self.z.items()} if self.z is not None else None
+
+        bounds = np.concatenate(([0], pos, [len(x) - 1]))
+
+        sections = []
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            sl = np.s_[a:b + 1]
+            z_sl = {k: v[sl] for k, v in zz.items()} if zz is not None else None
+            sections.append(Route._from_arrays(x[sl], y[sl], z_sl, dd[sl] - dd[a]))
+
+        return sections
+
+
+    @classmethod
+    def concat(cls, routes):
+        """Join Routes end to end into a single Route. Distances of each Route are offset by the distance travelled before it, including the straight line gap from the end of the previous Route, rather than being recalculated.
+
+        Args:
+            routes (list): list of Route objects. Either all or none of the Routes must have z data, with the same keys.
+
+        Returns:
+            Route: Return a new Route object.
+        """
+        routes = list(routes)
+        if len(routes) == 0:
+            raise ValueError("'routes' must contain at least one Route")
+
+        keys = [None if r.z is None else list(r.z.keys()) for r in routes]
+        if any(k != keys[0] for k in keys):
+            raise ValueError("All routes must have the same z data keys")
+
+        x = np.concatenate([r.x for r in routes])
+        y = np.concatenate([r.y for r in routes])
+
+        # gap between the end of each route and the start of the next
+        gaps = np.hypot(
+            np.array([r.x[0] for r in routes[1:]]) - np.array([r.x[-1] for r in routes[:-1]]),
+            np.array([r.y[0] for r in routes[1:]]) - np.array([r.y[-1] for r in routes[:-1]]),
+        )
+        lengths = np.array([r.d[-1] - r.d[0] for r in routes])
+        offsets = np.concatenate(([0], np.cumsum(lengths[:-1] + gaps)))
+        d = np.concatenate([r.d - r.d[0] + o for r, o in zip(routes, offsets)])
+
+        if keys[0] is not None:
+            zz = {k: np.concatenate([r.z[k] for r in routes]) for k in keys[0]}
+        else:
+            zz = None
+
+        return cls._from_arrays(x, y, zz, d)
+
+
+    @staticmethod
+    def _range_reduce(v, lo, hi, ufunc):
+        """Apply a min or max ufunc over the inclusive index ranges [lo, hi] of an array using a sparse table, so that each range is answered with two lookups.
+
+        Args:
+            v (array): 1d array of values.
+            lo (array): 1d array of range start indexes.
+            hi (array): 1d array of range end indexes, inclusive.
+            ufunc (ufunc): np.minimum or np.maximum.
+
+        Returns:
+            array: 1d array with the reduced value of each range.
+        """
+        length = hi - lo + 1
+        level = np.floor(np.log2(length)).astype(int)
+
+        # table[k][i] is the reduced value over v[i:i + 2**k]
+        table = [v]
+        for k in range(1, level.max() + 1):
+            prev = table[-1]
+            half = 2**(k - 1)
+            table.append(ufunc(prev[:-half], prev[half:]))
+
+        out = np.empty(len(lo), dtype=np.result_type(v, float))
+        for k in np.unique(level):
+            m = level == k
+            out[m] = ufunc(table[k][lo[m]], table[k][hi[m] - 2**k + 1])
+
+        return out
+
+
+    def rolling(self, window_distance, stats=('mean',), channels=None, center=False):
+        """Calculate rolling statistics of z data over windows of fixed distance along the route, for example a rolling 400 m average. Windows are defined along d rather than by number of points, so they adapt to uneven sampling.
+
+        Window bounds are found with np.searchsorted on d. Sums, means and standard deviations use cumulative sums, so the cost does not depend on the window size. Minimums and maximums use a sparse table over the window bounds.
+
+        Args:
+            window_distance (float): distance along the route covered by each window.
+            stats (list, optional): statistics to calculate. Options: 'mean', 'sum', 'min', 'max', 'std'. Defaults to ('mean',).
+            channels (list, optional): z data keys to calculate statistics for. If None, all z data is used. Defaults to None.
+            center (bool, optional): If True, windows are centered on each point. If False, each window ends at its point and covers the preceding distance. Defaults to False.
+
+        Returns:
+            Route: Return a new Route object with additional z data named '<channel>_<stat>'.
+        """
+        valid_stats = ('mean', 'sum', 'min', 'max', 'std')
+        if any(stat not in valid_stats for stat in stats):
+            raise ValueError(f"'stats' not recognised. Choose from {valid_stats}.")
+
+        if not window_distance > 0:
+            raise ValueError("'window_distance' must be greater than 0")
+
+        if self.z is None:
+            raise ValueError("Route has no z data to calculate rolling statistics for")
+
+        if channels is None:
+            channels = list(self.z.keys())
+
+        d = self.d
+        if center:
+            lo = np.searchsorted(d, d - window_distance/2., side='left')
+            hi = np.searchsorted(d, d + window_distance/2., side='right') - 1
+        else:
+            lo = np.searchsorted(d, d - window_distance, side='right')
+            hi = np.arange(len(d))
+
+        count = hi - lo + 1
+
+        def window_sum(v):
+            cs = np.concatenate(([0.], np.cumsum(v, dtype=float)))
+            return cs[hi + 1] - cs[lo]
+
+        zz = dict(self.z)
+        for k in channels:
+            v = self.z[k]
+
+            if 'sum' in stats:
+                zz[f'{k}_sum'] = window_sum(v)
+
+            if 'mean' in stats or 'std' in stats:
+                # shift by the mean to limit cancellation in the sum of squares
+                shift = v.mean()
+                s1 = window_sum(v - shift)
+                mean = s1/count
+
+                if 'mean' in stats:
+                    zz[f'{k}_mean'] = mean + shift
+
+                if 'std' in stats:
+                    s2 = window_sum((v - shift)**2)
+                    with np.errstate(invalid='ignore', divide='ignore'):
+                        var = np.maximum(s2 - s1*mean, 0)/(count - 1)
+                    zz[f'{k}_std'] = np.where(count > 1, np.sqrt(var), np.nan)
+
+            if 'min' in stats:
+                zz[f'{k}_min'] = self._range_reduce(v, lo, hi, np.minimum)
+
+            if 'max' in stats:
+                zz[f'{k}_max'] = self._range_reduce(v, lo, hi, np.maximum)
+
+        return Route._from_arrays(self.x, self.y, zz, self.d)
+
+
+    def build_lod(self, levels=8, min_tolerance=None):
+        """Precompute a level of detail pyramid of progressively simplified versions of the route, for example for rendering at different zoom levels. Douglas-Peucker significance is calculated once for every point, and each level is an index array into the route's points. Level 0 is the full route and level k > 0 is simplified to within min_tolerance * 2**(k - 1), so the level for a requested tolerance or pixel size is found in constant time. The pyramid is cached on the Route.
+
+        Args:
+            levels (int, optional): number of levels including the full resolution route. Defaults to 8.
+            min_tolerance (float, optional): simplification tolerance of level 1. If None, the largest route extent divided by 2**(levels + 2). Defaults to None.
+
+        Returns:
+            LevelOfDetail: the pyramid. Use its get(tolerance=..., pixel_size=...) method to retrieve a simplified Route.
+        """
+        cache = self._cache()
+        key = ('lod', levels, min_tolerance)
+        if key not in cache:
+            cache[key] = LevelOfDetail.build(self, levels=levels, min_tolerance=min_tolerance)
+
+        return cache[key]
+
     # TODO: Add Univariate Spline
     # def add_spline(self):
 
     #     return
 
 
-    def smooth(self, smoothing_factor=None):
+    @memoized
+    def smooth(self, smoothing_factor=None, num=5000, spacing=None, arc_length=False):
         """Smooth the route using cubic interpolation by varying the smoothing factor from 0 to 1.
 
         The smoothing factor dictates how much smoothing will be applied. The factor reduces the number of route coordinate points relative to the mean change in distance between coordinates. With a reduced number of points, the route is smoothed using Scipy's cubic interpolation. Consquently, the higher the factor, the fewer coordinate points and the higher level of smoothing. The smoothing factor must be greater than or equal to 0 and less than 1.0.
 
+        By default the smoothed route is sampled at points spaced linearly along the distance of the points it was fitted to, so the spacing along the curve itself varies. With 'spacing' or 'arc_length', points are instead placed at exactly equal arc length along the fitted curve, see ArcLength. This is about 10x slower for long routes.
+
         Args:
             smoothing_factor (float): level of smoothing to apply between 0 (no smoothing) and 1 (max smoothing). Must be less than 1.
+            num (int, optional): number of points of the smoothed route. Defaults to 5000.
+            spacing (float, optional): arc length between points of the smoothed route, used instead of 'num'. The end point is kept if it does not fall on a step. Defaults to None.
+            arc_length (bool, optional): If True, place the 'num' points at equal arc length along the curve. Defaults to False.
 
         Returns:
             Route: Return a new Route object.
@@ -408,12 +1093,22 @@ class Route:
             # clean coords list first. Interpolation cannot handle duplicate values in the list.
             r = r.clean_coordinates()
 
-        # Use linspace to get a new list of distanced points
-        dist = np.linspace(r.d.min(), r.d.max(), num=5000)
+        if spacing is not None or arc_length:
+            # cubic curve through the points wrt to d, sampled at equal arc length
+            curve = ArcLength(r.d, r.x, r.y)
+            if spacing is not None:
+                dist = curve.resample(spacing=spacing)
+            else:
+                dist = curve.resample(num=num)
+            fx, fy = curve.fx, curve.fy
+
+        else:
+            # Use linspace to get a new list of distanced points
+            dist = np.linspace(r.d.min(), r.d.max(), num=num)
 
-        # interpolation functions for x and y wrt to d
-        fx = interp1d(r.d, r.x, kind='cubic')
-        fy = interp1d(r.d, r.y, kind='cubic')
+            # interpolation functions for x and y wrt to d
+            fx = make_interp_spline(r.d, r.x, k=3)
+            fy = make_interp_spline(r.d, r.y, k=3)
 
         # apply function to distanced points
         xx, yy = fx(dist), fy(dist)
@@ -422,7 +1117,7 @@ class Route:
         if self.z is not None:
             zz = {}
             for k, v in r.z.items():
-                fz = interp1d(r.d, v, kind='cubic')
+                fz = make_interp_spline(r.d, v, k=3)
                 zz[k] = fz(dist)
         else:
             zz = None
@@ -484,11 +1179,11 @@ class Route:
 
     @staticmethod
     def _rotate_point(origin, point, angle):
-        """Rotate a point counterclockwise by a given angle around a given origin.
+        """Rotate a point counterclockwise by a given angle around a given origin. The point coordinates may also be arrays, to rotate many points at once.
 
         Args:
             origin (tuple): (x, y) point about which to rotate the point
-            point (tuple): (x, y) point to rotate
+            point (tuple): (x, y) point to rotate, or (x, y) arrays of points
             angle (float): angle to rotate point. The angle should be given in radians.
 
         Returns:
@@ -512,18 +1207,13 @@ class Route:
         Returns:
             Route: Return a new Route object.
         """
-        xy = list(zip(self.x, self.y))
         c = self.center()
         rad = -math.radians(angle_deg)
 
-        x_new = []
-        y_new = []
-        for x, y in xy:
-            p = self._rotate_point(c, (x, y), rad)
-            x_new.append(p[0])
-            y_new.append(p[1])
+        # _rotate_point applied to all points at once
+        x_new, y_new = self._rotate_point(c, (self.x, self.y), rad)
 
-        return Route(x_new, y_new, z=self.z)
+        return self._transform_cache(Route(x_new, y_new, z=self.z), lambda h: h - angle_deg, flip=False)
 
 
     def mirror(self, about_x=False, about_y=False, about_axis=False):
@@ -543,20 +1233,23 @@ class Route:
             c = self.center()
 
         if about_y:
-            x_new = []
-            for p in self.x:
-                x_new.append(c[0] + (c[0] - p))
+            x_new = c[0] + (c[0] - self.x)
         else:
             x_new = self.x
 
         if about_x:
-            y_new = []
-            for p in self.y:
-                y_new.append(c[1] + (c[1] - p))
+            y_new = c[1] + (c[1] - self.y)
         else:
             y_new = self.y
 
-        return Route(x_new, y_new, z=self.z)
+        def heading_fn(h):
+            if about_y:
+                h = 180. - h
+            if about_x:
+                h = -h
+            return h
+
+        return self._transform_cache(Route(x_new, y_new, z=self.z), heading_fn, flip=about_x != about_y)
 
 
     def fit_to_box(self, box_width, box_height, keep_aspect=True):
@@ -587,6 +1280,7 @@ class Route:
         return Route(x_new, y_new, z=self.z)
 
 
+    @memoized
     def optimise_bbox(self, box_width, box_height):
         """Rotate the route to the most efficient use of space given the width and height of a bounding box. This does not scale the route to fill the space but rather find the best aspect ratio of the route that best matches that of the specified box width and height.
 
@@ -601,19 +1295,38 @@ class Route:
         """
         target = box_width/box_height
 
-        angles = []
-        spatial_eff = [] # spatial efficiency
-        for angle in np.arange(-90, 91, 1):
-            r_rotated = self.rotate(angle)
-            spatial_ratio = abs(r_rotated.width()/r_rotated.height())
-
-            angles.append(angle)
-            spatial_eff.append(abs(spatial_ratio - target))
+        c = self.center()
+        angles = np.arange(-90, 91, 1)
+        spatial_eff = np.empty(len(angles)) # spatial efficiency
 
-        angles = np.array(angles)
-        spatial_eff = np.array(spatial_eff)
+        # only the rotated extents are needed, so rotate the coordinates without creating a Route for each angle
+        for i, angle in enumerate(angles):
+            x, y = self._rotate_point(c, (self.x, self.y), -math.radians(angle))
+            spatial_ratio = abs((x.max() - x.min())/(y.max() - y.min()))
+            spatial_eff[i] = abs(spatial_ratio - target)
 
         idx = spatial_eff.argmin()
         angle = angles[idx]
 
         return self.rotate(angle)
+
+
+    @staticmethod
+    def map_threaded(fn, routes, workers=None, **kwargs):
+        """Apply a function or Route method to many Routes using a pool of threads. The core Route operations are whole-array NumPy operations, which release the GIL, so threads can run them in parallel without the overhead of a process pool.
+
+        Args:
+            fn (function or str): function taking a Route as its first argument, or the name of a Route method.
+            routes (list): list of Route objects.
+            workers (int, optional): number of threads. Defaults to None, the ThreadPoolExecutor default.
+            **kwargs: keyword arguments passed to fn.
+
+        Returns:
+            list: results in the same order as routes.
+        """
+        if isinstance(fn, str):
+            name = fn
+            fn = lambda r, **kw: getattr(r, name)(**kw)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(lambda r: fn(r, **kwargs), routes))
@@ -0,0 +1,68 @@
+''' Routely arc length tests '''
+# Packages
+import numpy as np
+import pytest
+from routely.arclength import ArcLength
+
+
+def _parabola_length(t):
+    # exact arc length of (t, t**2) from 0 to t
+    return t/2*np.sqrt(1 + 4*t**2) + np.arcsinh(2*t)/4
+
+
+def _setup():
+    # cubic splines reproduce the parabola (t, t**2) exactly
+    t = np.linspace(0, 3, 7)
+    return ArcLength(t, t, t**2)
+
+
+def test_length():
+    c = _setup()
+    assert c.length() == pytest.approx(_parabola_length(3.), rel=1e-12)
+
+    t = np.linspace(0, 3, 101)
+    assert np.allclose(_parabola_length(t), c.s(t), rtol=1e-12, atol=1e-12)
+    assert np.allclose(np.sqrt(1 + 4*t**2), c.speed(t))
+
+    # straight line parameterised by its length
+    t = np.cumsum(np.r_[0, np.arange(1, 10)])
+    c = ArcLength(t, 0.6*t, 0.8*t)
+    assert c.length() == pytest.approx(t[-1])
+
+    with pytest.raises(ValueError):
+        ArcLength([0, 1, 1, 2], [0, 1, 2, 3], [0, 1, 2, 3])
+
+
+def test_inverse():
+    c = _setup()
+    s = np.linspace(0, c.length(), 257)
+    t = c.t(s)
+    assert np.all(np.diff(t) > 0)
+    assert np.allclose(s, _parabola_length(t), rtol=0, atol=1e-9)
+    assert np.allclose(s, c.s(t), rtol=0, atol=1e-9)
+
+    # out of range lengths are clipped to the ends
+    assert list(c.t([-1, c.length() + 1])) == pytest.approx([0, 3])
+
+
+def test_resample():
+    c = _setup()
+
+    t = c.resample(num=50)
+    assert (0, 3) == (t[0], t[-1])
+    assert np.allclose(np.diff(_parabola_length(t)), c.length()/49, rtol=1e-9)
+
+    t = c.resample(spacing=0.25)
+    steps = np.diff(_parabola_length(t))
+    assert np.allclose(steps[:-1], 0.25)
+    assert 0 < steps[-1] <= 0.25
+    assert 3 == t[-1]
+
+    with pytest.raises(ValueError):
+        c.resample()
+    with pytest.raises(ValueError):
+        c.resample(num=10, spacing=1)
+    with pytest.raises(ValueError):
+        c.resample(num=1)
+    with pytest.raises(ValueError):
+        c.resample(spacing=0)
@@ -0,0 +1,129 @@
+''' Routely cache tests '''
+# Packages
+import numpy as np
+import pytest
+from routely import Route
+from routely import cache
+
+
+def _setup():
+    x = [0, 5, 15, 20, 10]
+    y = [0, 10, 40, 10, 5]
+    z = {'foo':[0, 10, 40, 10, 5]}
+    return Route(x, y, z=z)
+
+
+@pytest.fixture(autouse=True)
+def _disable_cache():
+    yield
+    cache.disable_cache()
+
+
+def test_content_hash():
+    r1 = _setup()
+    r2 = _setup()
+    assert r1.content_hash() == r2.content_hash()
+
+    # dtype, values and z keys all change the hash
+    assert r1.content_hash() != Route(r1.x.astype(float), r1.y, z={'foo':r1.z['foo']}).content_hash()
+    assert r1.content_hash() != Route(r1.x, r1.y + 1, z={'foo':r1.z['foo']}).content_hash()
+    assert r1.content_hash() != Route(r1.x, r1.y, z={'bar':r1.z['foo']}).content_hash()
+    assert r1.content_hash() != Route(r1.x, r1.y).content_hash()
+
+
+def test_memoized_methods():
+    assert cache.get_cache() is None
+
+    c = cache.enable_cache()
+    r = _setup()
+
+    r2 = r.interpolate(num=2)
+    assert {'hits':0, 'misses':1} == {k: c.stats()[k] for k in ['hits', 'misses']}
+
+    # equal route and equivalent arguments hit the cache
+    r3 = _setup().interpolate(kind='equidistant_steps', num=2)
+    assert np.array_equal(r2.x, r3.x)
+    assert 1 == c.stats()['hits']
+
+    # different arguments miss
+    r.interpolate(num=3)
+    assert 2 == c.stats()['misses']
+
+    r.optimise_bbox(10, 5)
+    r.optimise_bbox(10, 5)
+    assert 2 == c.stats()['hits']
+    assert 0.4 == c.stats()['hit_rate']
+
+    cache.disable_cache()
+    assert r.interpolate(num=2) is not r2
+
+
+def test_memoized_copies():
+    cache.enable_cache()
+    r = _setup()
+    expected = r.interpolate(num=5)
+
+    # a copy with new data gets its own hash and results
+    r2 = r.copy()
+    r2.x = r2.x*3
+    r2.d = r2._calculate_distance()
+    assert r.content_hash() != r2.content_hash()
+    assert np.array_equal(r2.x[-1], r2.interpolate(num=5).x[-1])
+    assert not np.array_equal(expected.x, r2.interpolate(num=5).x)
+
+    # changing a cached result does not change later hits
+    expected.x[:] = -1
+    assert np.array_equal(_setup().interpolate(num=5).x, r.copy().interpolate(num=5).x)
+    assert -1 != r.interpolate(num=5).x[0]
+
+
+def test_memory_backend_bounds():
+    backend = cache.MemoryBackend(max_bytes=1000)
+    backend.set('a', np.zeros(50))
+    backend.set('b', np.zeros(50))
+    backend.get('a')
+    backend.set('c', np.zeros(50))
+
+    # b was least recently used
+    assert 800 == backend.nbytes()
+    backend.get('a')
+    with pytest.raises(KeyError):
+        backend.get('b')
+
+    # too large to store
+    backend.set('d', np.zeros(1000))
+    with pytest.raises(KeyError):
+        backend.get('d')
+
+
+def test_disk_backend(tmp_path):
+    c = cache.enable_cache(cache.DiskBackend(str(tmp_path)))
+    r = _setup()
+    r2 = r.interpolate(num=2)
+
+    # a second cache over the same directory, as in another process, shares results
+    c2 = cache.enable_cache(cache.DiskBackend(str(tmp_path)))
+    r3 = _setup().interpolate(num=2)
+    assert 1 == c2.stats()['hits']
+    assert list(r2.x) == list(r3.x)
+    assert list(r2.z['foo']) == list(r3.z['foo'])
+
+    backend = cache.DiskBackend(str(tmp_path / 'small'), max_bytes=2000)
+    for i in range(10):
+        backend.set(str(i), np.zeros(100))
+    assert backend.nbytes() <= 2000
+    assert 0 == backend.get('9').sum()
+    with pytest.raises(KeyError):
+        backend.get('0')
+
+    # the directory is only scanned when it may have grown over the limit
+    backend = cache.DiskBackend(str(tmp_path / 'large'))
+    scans = []
+    entries = backend._entries
+    backend._entries = lambda: scans.append(1) or entries()
+    for i in range(100):
+        backend.set(str(i), np.zeros(100))
+    assert 100//backend.rescan_interval + 1 == len(scans)
+
+    c2.clear()
+    assert 0 == c2.stats()['nbytes']
@@ -0,0 +1,166 @@
+''' Routely chunked processing tests '''
+# Packages
+import numpy as np
+import pytest
+from routely import Route
+from routely.chunked import ChunkedRoute
+from routely.lod import significance
+from routely.memory import measure
+
+
+def _setup(n=1000):
+    rng = np.random.default_rng(0)
+    x = np.cumsum(rng.normal(size=n))
+    y = np.cumsum(rng.normal(size=n))
+
+    # consecutive duplicates, including across chunk boundaries
+    x[[10, 11, 12, 99, 100]] = x[9]
+    y[[10, 11, 12, 99, 100]] = y[9]
+    x[[50, 51]] = x[49]
+    y[[50, 51]] = y[49]
+
+    return Route(x, y, z={'foo':rng.normal(size=n)})
+
+
+@pytest.mark.parametrize('chunk_size', [2, 7, 100, 5000])
+def test_chunked_route(tmp_path, chunk_size):
+    r = _setup()
+    c = ChunkedRoute.from_route(r, tmp_path/'route', chunk_size=chunk_size)
+
+    assert r.nr_points() == c.nr_points()
+    assert np.allclose(r.d, c.distance())
+    assert r.bbox() == c.bbox()
+
+    r2 = c.to_route()
+    assert np.array_equal(r.x, r2.x)
+    assert np.array_equal(r.z['foo'], r2.z['foo'])
+
+    # chunks overlap by one point
+    chunks = list(c.chunks())
+    assert c.nr_chunks() == len(chunks)
+    assert np.array_equal(r.x, np.concatenate([chunks[0][0]] + [ch[0][1:] for ch in chunks[1:]]))
+
+
+@pytest.mark.parametrize('chunk_size', [2, 7, 100, 5000])
+def test_chunked_clean_coordinates(tmp_path, chunk_size):
+    r = _setup()
+    c = ChunkedRoute.from_route(r, tmp_path/'route', chunk_size=chunk_size)
+
+    expected = r.clean_coordinates()
+    result = c.clean_coordinates(tmp_path/'clean').to_route()
+    assert np.array_equal(expected.x, result.x)
+    assert np.array_equal(expected.y, result.y)
+    assert np.array_equal(expected.z['foo'], result.z['foo'])
+
+
+@pytest.mark.parametrize('chunk_size', [2, 7, 100, 5000])
+@pytest.mark.parametrize('kind, num', [('equidistant_steps', 0.7), ('equidistant_steps', 5), ('absolute_steps', 333), ('absolute_steps', 2)])
+def test_chunked_interpolate(tmp_path, chunk_size, kind, num):
+    r = _setup()
+    c = ChunkedRoute.from_route(r, tmp_path/'route', chunk_size=chunk_size)
+
+    expected = r.interpolate(kind=kind, num=num)
+    result = c.interpolate(tmp_path/'interp', kind=kind, num=num).to_route()
+    assert expected.nr_points() == result.nr_points()
+    assert np.allclose(expected.x, result.x)
+    assert np.allclose(expected.y, result.y)
+    assert np.allclose(expected.z['foo'], result.z['foo'])
+
+    with pytest.raises(ValueError):
+        c.interpolate(tmp_path/'interp', kind='foo')
+
+
+@pytest.mark.parametrize('chunk_size', [3, 100, 5000])
+def test_chunked_simplify(tmp_path, chunk_size):
+    r = _setup()
+    c = ChunkedRoute.from_route(r, tmp_path/'route', chunk_size=chunk_size)
+    result = c.simplify(tmp_path/'simple', 2.).to_route()
+
+    # every chunk boundary is kept, and each chunk is simplified within tolerance
+    boundaries = np.arange(0, r.nr_points(), chunk_size - 1)
+    assert set(zip(r.x[boundaries], r.y[boundaries])) <= set(zip(result.x, result.y))
+    assert result.nr_points() < r.nr_points()
+
+    if chunk_size >= r.nr_points():
+        keep = significance(r.x, r.y) > 2.
+        assert np.array_equal(r.x[keep], result.x)
+
+
+def test_chunked_writer(tmp_path):
+    r = _setup()
+    with ChunkedRoute.writer(tmp_path/'route', z_keys=['foo']) as w:
+        for start in range(0, r.nr_points(), 300):
+            sl = slice(start, start + 300)
+            w.append(r.x[sl], r.y[sl], {'foo':r.z['foo'][sl]})
+
+    c = ChunkedRoute(tmp_path/'route', chunk_size=64)
+    assert np.array_equal(r.x, c.x)
+    assert np.allclose(r.d, c.distance())
+
+    # rewriting the route discards its stored distance
+    ChunkedRoute.from_route(Route([0, 1], [0, 0]), tmp_path/'route')
+    assert np.array_equal([0, 1], ChunkedRoute(tmp_path/'route').distance())
+
+    with pytest.raises(ValueError):
+        ChunkedRoute(tmp_path/'route', chunk_size=1)
+
+
+def _interrupt(chunks):
+    yield next(chunks)
+    raise KeyboardInterrupt
+
+
+def test_chunked_interrupted(tmp_path, monkeypatch):
+    r = _setup()
+    c = ChunkedRoute.from_route(r, tmp_path/'route', chunk_size=100)
+
+    # interrupted writes leave no partial files behind
+    chunks = ChunkedRoute.chunks
+    monkeypatch.setattr(ChunkedRoute, 'chunks', lambda self, with_distance=False: _interrupt(chunks(self, with_distance)))
+    with pytest.raises(KeyboardInterrupt):
+        c.distance()
+    with pytest.raises(KeyboardInterrupt):
+        c.clean_coordinates(tmp_path/'clean')
+    assert {'route.json', 'x.npy', 'y.npy', 'z_0.npy'} == {p.name for p in (tmp_path/'route').iterdir()}
+    assert not (tmp_path/'clean').exists()
+
+    monkeypatch.setattr(ChunkedRoute, 'chunks', chunks)
+    assert np.allclose(r.d, c.distance())
+
+    # an aborted rewrite leaves the existing route as it was
+    with pytest.raises(KeyError):
+        with ChunkedRoute.writer(tmp_path/'route', z_keys=['q']) as w:
+            w.append([0, 1], [0, 1], {'q':[0, 1]})
+            raise KeyError
+    c = ChunkedRoute(tmp_path/'route')
+    assert ['foo'] == c.z_keys
+    assert np.array_equal(r.z['foo'], c.z['foo'])
+    assert np.allclose(r.d, c.distance())
+    assert {'route.json', 'x.npy', 'y.npy', 'z_0.npy', 'd.npy'} == {p.name for p in (tmp_path/'route').iterdir()}
+
+    # and an aborted new route leaves nothing
+    with pytest.raises(KeyError):
+        with ChunkedRoute.writer(tmp_path/'new') as w:
+            raise KeyError
+    assert not (tmp_path/'new').exists()
+
+
+def test_chunked_memory(tmp_path):
+    # peak memory follows the chunk size, not the route size
+    chunk_size = 1000
+    peaks = []
+    for n in [20000, 200000]:
+        r = _setup(n)
+        c = ChunkedRoute.from_route(r, tmp_path/f'route{n}', chunk_size=chunk_size)
+        del r
+
+        def run():
+            c.distance()
+            c.clean_coordinates(tmp_path/f'clean{n}')
+            c.interpolate(tmp_path/f'interp{n}', kind='equidistant_steps', num=0.5)
+
+        _, report = measure(run, nr_points=n)
+        peaks.append(report.peak)
+
+    assert peaks[1] < 2*peaks[0]
+    assert peaks[1] < 200*chunk_size
@@ -0,0 +1,62 @@
+''' Routely features tests '''
+# Packages
+import numpy as np
+import pytest
+from routely import Route
+from routely.features import resample_many
+
+
+def _setup():
+    rng = np.random.default_rng(0)
+    routes = []
+    for n in [2, 5, 17, 40]:
+        x = np.cumsum(rng.normal(size=n))
+        y = np.cumsum(rng.normal(size=n))
+        routes.append(Route(x, y, z={'foo':rng.normal(size=n)}))
+
+    # includes a repeated point and int coordinates
+    routes.append(Route([0, 3, 3, 6], [0, 4, 4, 0], z={'foo':[1, 2, 3, 4]}))
+    return routes
+
+
+def _expected(routes, num, channels, normalize=()):
+    rows = []
+    for r in routes:
+        r2 = r.interpolate(kind='absolute_steps', num=num)
+        for kind in normalize:
+            if kind == 'center_on_origin':
+                r2 = r2.center_on_origin()
+            else:
+                r2 = r2.fit_to_box(2, 1)
+        rows.append(r2.dataframe()[channels].to_numpy())
+    return np.stack(rows)
+
+
+def test_resample_many():
+    routes = _setup()
+    channels = ['x', 'y', 'd', 'foo']
+
+    out = resample_many(routes, 20, channels=channels)
+    assert (len(routes), 20, 4) == out.shape
+    assert _expected(routes, 20, channels) == pytest.approx(out)
+
+
+def test_resample_many_normalize():
+    routes = _setup()
+    channels = ['x', 'y', 'd']
+    normalize = ['center_on_origin', 'fit_to_box']
+
+    out = np.zeros((len(routes), 8, 3))
+    result = resample_many(routes, 8, channels=channels, normalize=normalize, box_size=(2, 1), out=out)
+
+    assert result is out
+    assert _expected(routes, 8, channels, normalize) == pytest.approx(out)
+
+    with pytest.raises(ValueError):
+        resample_many(routes, 8, normalize='unknown')
+
+    with pytest.raises(ValueError):
+        resample_many(routes, 8, channels=['bar'])
+
+    with pytest.raises(ValueError):
+        resample_many(routes, 8, out=np.zeros((1, 8, 2)))
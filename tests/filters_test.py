@@ -0,0 +1,60 @@
+''' Routely filters tests '''
+# Packages
+import numpy as np
+import pytest
+from routely import Route, KalmanFilter
+
+
+def _setup():
+    rng = np.random.default_rng(0)
+    t = np.arange(200.)
+    x = 2*t + rng.normal(0, 3, len(t))
+    y = 50*np.sin(t/20) + rng.normal(0, 3, len(t))
+    z = {'foo':120 + rng.normal(0, 5, len(t))}
+    return Route(x, y, z=z)
+
+
+def test_apply():
+    r = _setup()
+    r2 = KalmanFilter().apply(r)
+
+    assert r.nr_points() == r2.nr_points()
+    assert (r.x[0], r.y[0]) == (r2.x[0], r2.y[0])
+
+    # filtered route is smoother
+    assert np.abs(np.diff(r2.x, 2)).mean() < np.abs(np.diff(r.x, 2)).mean()
+    assert np.abs(np.diff(r2.z['foo'])).mean() < np.abs(np.diff(r.z['foo'])).mean()
+
+    # constant velocity is tracked exactly once the initial velocity has converged
+    r = Route(np.arange(100.), 3*np.arange(100.))
+    r2 = KalmanFilter().apply(r)
+    assert list(r.x[-10:]) == pytest.approx(list(r2.x[-10:]))
+
+
+def test_streaming_matches_batch():
+    r = _setup()
+    batch = KalmanFilter().apply(r)
+
+    f = KalmanFilter()
+    points = [f.update(x, y, {'foo':z}) for x, y, z in zip(r.x, r.y, r.z['foo'])]
+    assert list(batch.x) == [p[0] for p in points]
+    assert list(batch.y) == [p[1] for p in points]
+    assert list(batch.z['foo']) == [p[2]['foo'] for p in points]
+
+    f = KalmanFilter()
+    chunks = [f.update_batch(r.x[i:i + 17], r.y[i:i + 17], {'foo':r.z['foo'][i:i + 17]}) for i in range(0, 200, 17)]
+    assert list(batch.x) == list(np.concatenate([c[0] for c in chunks]))
+
+    # reset starts a new track
+    f.reset()
+    assert (r.x[5], r.y[5]) == f.update(r.x[5], r.y[5], {'foo':0})[:2]
+
+
+def test_kalman_filter_errors():
+    with pytest.raises(ValueError):
+        KalmanFilter(process_noise=0)
+
+    f = KalmanFilter()
+    f.update(0, 0, {'foo':1})
+    with pytest.raises(ValueError):
+        f.update(1, 1, {'bar':1})
@@ -0,0 +1,123 @@
+''' Routely index tests '''
+# Packages
+import numpy as np
+import pytest
+from routely import Route, RouteIndex
+
+
+def _setup(n=500, seed=0):
+    rng = np.random.default_rng(seed)
+    lower = rng.uniform(0, 100, (n, 2))
+    upper = lower + rng.uniform(0, 5, (n, 2))
+    return np.hstack([lower, upper])
+
+
+def _brute_query(boxes, q):
+    return set(np.flatnonzero(
+        (boxes[:, 0] <= q[2]) & (boxes[:, 2] >= q[0]) & (boxes[:, 1] <= q[3]) & (boxes[:, 3] >= q[1])
+    ))
+
+
+def test_from_routes():
+    routes = [
+        Route([0, 1, 2], [0, 1, 0]),
+        Route([10, 11, 12], [10, 12, 10]),
+        Route([0, 20], [5, 5]),
+    ]
+    idx = RouteIndex.from_routes(routes)
+
+    assert 3 == len(idx)
+    assert {0, 2} == set(idx.query(((0.5, 0.5), (1.5, 6))))
+    assert {1} == set(idx.query(routes[1].bbox()))
+
+
+def test_query():
+    boxes = _setup()
+    idx = RouteIndex(boxes, node_size=4)
+
+    queries = np.array([[10, 10, 30, 20], [0, 0, 1, 1], [50, 50, 50, 50], [-10, -10, -5, -5]])
+    results = idx.query_many(queries)
+
+    assert len(queries) == len(results)
+    for q, res in zip(queries, results):
+        assert _brute_query(boxes, q) == set(res)
+
+
+def test_nearest():
+    boxes = _setup()
+    idx = RouteIndex(boxes, node_size=4)
+
+    points = np.array([[10, 10], [50, 90], [-20, 120]])
+    for p, (ids, dist) in zip(points, idx.nearest_many(points, k=5, return_distance=True)):
+        dx = np.maximum(np.maximum(boxes[:, 0] - p[0], p[0] - boxes[:, 2]), 0)
+        dy = np.maximum(np.maximum(boxes[:, 1] - p[1], p[1] - boxes[:, 3]), 0)
+        expected = np.sort(np.hypot(dx, dy))[:5]
+
+        assert 5 == len(ids)
+        assert expected == pytest.approx(dist)
+
+    # more neighbours than items
+    assert 3 == len(RouteIndex(boxes[:3]).nearest((0, 0), k=10))
+
+
+def test_insert_delete():
+    boxes = _setup(100)
+    idx = RouteIndex(boxes)
+
+    new_id = idx.insert(((200, 200), (201, 201)))
+    assert 100 == new_id
+    assert [new_id] == list(idx.query(((199, 199), (200.5, 200.5))))
+    assert [new_id] == list(idx.nearest((300, 300)))
+
+    idx.delete(5)
+    assert 5 not in idx
+    assert 5 not in idx.query(boxes[5])
+    assert 100 == len(idx)
+
+    with pytest.raises(KeyError):
+        idx.delete(5)
+
+    with pytest.raises(ValueError):
+        idx.insert(boxes[0], item_id=0)
+
+    # enough inserts to trigger a rebuild
+    new_ids = [idx.insert(boxes[i] + 1000) for i in range(50)]
+    assert 150 == len(idx)
+    assert len(idx._pending_ids) < 50
+
+    expected = {new_ids[i] for i in _brute_query(boxes[:50] + 1000, [1000, 1000, 1050, 1050])}
+    assert expected == set(idx.query(((1000, 1000), (1050, 1050))))
+
+
+def test_save_load(tmp_path):
+    boxes = _setup()
+    idx = RouteIndex(boxes, ids=np.arange(len(boxes)) * 2)
+    idx.delete(4)
+    path = str(tmp_path / 'routes.idx')
+    idx.save(path)
+
+    idx2 = RouteIndex.load(path)
+    assert isinstance(idx2._boxes, np.memmap)
+    assert len(idx) == len(idx2)
+
+    q = [20, 20, 40, 40]
+    assert set(idx.query(q)) == set(idx2.query(q))
+    assert 4 not in idx2
+
+    # loaded indexes remain mutable
+    idx2.delete(6)
+    new_id = idx2.insert(((500, 500), (501, 501)))
+    assert [new_id] == list(idx2.query(((500, 500), (500, 500))))
+
+
+def test_save_over_loaded(tmp_path):
+    boxes = _setup()
+    path = str(tmp_path / 'routes.idx')
+    RouteIndex(boxes).save(path)
+
+    # the loaded arrays are memory-mapped from the file being replaced
+    idx = RouteIndex.load(path)
+    idx.save(path)
+    q = [20, 20, 40, 40]
+    assert set(idx.query(q)) == set(RouteIndex.load(path).query(q))
+    assert [path] == [str(p) for p in tmp_path.iterdir()]
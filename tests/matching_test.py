@@ -0,0 +1,86 @@
+''' Routely matching tests '''
+# Packages
+import numpy as np
+import pytest
+from routely import Route
+from routely.matching import RoadGraph, match
+
+
+def _setup():
+    # 10 x 10 grid of roads with 100 spacing
+    g = np.arange(0, 1001, 100.)
+    xx, yy = np.meshgrid(g, g)
+    nodes = np.stack([xx.ravel(), yy.ravel()], axis=1)
+
+    idx = np.arange(len(nodes)).reshape(len(g), len(g))
+    edges = np.vstack([
+        np.stack([idx[:, :-1].ravel(), idx[:, 1:].ravel()], axis=1),
+        np.stack([idx[:-1, :].ravel(), idx[1:, :].ravel()], axis=1),
+    ])
+    return RoadGraph(nodes, edges)
+
+
+def _true_path():
+    # along y=350 is off road, so use y=300 then turn up x=500
+    x = np.r_[np.arange(10, 500, 10.), np.full(49, 500.)]
+    y = np.r_[np.full(49, 300.), np.arange(310, 800, 10.)]
+    return x, y
+
+
+def test_candidates():
+    graph = _setup()
+    point, edge, offset, px, py, dist = graph.candidates(np.array([150., 5000.]), np.array([310., 0.]), radius=20)
+
+    # only the road along y=300 is within radius of the first point, the second is off the map
+    assert [0] == list(point)
+    assert [(150, 300)] == list(zip(px, py))
+    assert [10] == list(dist)
+    assert 50 == offset[0]
+
+
+def test_match():
+    graph = _setup()
+    x, y = _true_path()
+    rng = np.random.default_rng(0)
+    r = Route(x + rng.normal(0, 5, len(x)), y + rng.normal(0, 5, len(y)), z={'foo':np.arange(len(x))})
+
+    m, edges = match(r, graph, radius=40, sigma=5, return_edges=True)
+
+    assert r.nr_points() == m.nr_points()
+    assert list(r.z['foo']) == list(m.z['foo'])
+    assert len(edges) == m.nr_points()
+
+    # matched points lie on a road, close to the true path
+    on_road = np.isclose(m.x % 100, 0) | np.isclose(m.y % 100, 0)
+    assert on_road.all()
+    assert (np.hypot(m.x - x, m.y - y) < 20).all()
+
+    # and mostly on the roads of the true path
+    on_path = np.r_[np.isclose(m.y[:49], 300), np.isclose(m.x[49:], 500)]
+    assert on_path.mean() > 0.9
+
+
+def test_match_drops_far_points(tmp_path):
+    graph = _setup()
+    path = str(tmp_path / 'roads.npz')
+    graph.save(path)
+    graph = RoadGraph.load(path)
+
+    r = Route([110, 150, 150, 190], [301, 299, 350, 300])
+    m = match(r, graph, radius=10)
+    assert [110, 150, 190] == pytest.approx(list(m.x))
+    assert [300, 300, 300] == pytest.approx(list(m.y))
+
+    with pytest.raises(ValueError):
+        match(Route([150, 160], [350, 350]), graph, radius=10)
+
+
+def test_subgraph_duplicate_edges():
+    graph = _setup()
+
+    # the same roads listed again, in either direction, do not change road lengths
+    edges = np.vstack([graph.edges, graph.edges[:5, ::-1], graph.edges[:5]])
+    graph2 = RoadGraph(graph.nodes, edges)
+    sub, nodes = graph2._subgraph(np.arange(len(edges)))
+    assert 100 == sub[0, 1] + sub[1, 0]
+    assert len(graph.edges) == sub.nnz
@@ -0,0 +1,82 @@
+''' Routely memory budget tests '''
+# Packages
+import numpy as np
+import pytest
+from routely import Route
+from routely.memory import check_budget, measure
+
+
+SIZES = [10000, 100000]
+
+# Fixed allowance for small allocations that do not scale with the route, eg Python objects
+FIXED_BYTES = 100000
+
+# Budgets in bytes per input point as (operation, peak, retained). The input route has float x, y
+# and one z channel, so an output Route holding x, y, z and d retains 32 bytes per point.
+BUDGETS = [
+    ('init', lambda r: Route(r.x, r.y, z=dict(r.z)), 80, 40),
+    ('dataframe', lambda r: r.dataframe(), 48, 40),
+    ('bbox', lambda r: r.bbox(), 1, 1),
+    ('interpolate', lambda r: r.interpolate(kind='absolute_steps', num=r.nr_points()), 120, 40),
+    ('clean_coordinates', lambda r: r.clean_coordinates(), 120, 40),
+    ('clean_coordinates_any', lambda r: r.clean_coordinates(duplicates='any'), 120, 40),
+    ('rotate', lambda r: r.rotate(30), 110, 40),
+    ('mirror', lambda r: r.mirror(about_x=True, about_y=True), 110, 40),
+    ('center_on_origin', lambda r: r.center_on_origin(), 110, 40),
+    ('fit_to_box', lambda r: r.fit_to_box(1, 1), 110, 40),
+    ('optimise_bbox', lambda r: r.optimise_bbox(2, 1), 130, 40),
+    ('to_bytes', lambda r: r.to_bytes(), 180, 16),
+    ('rolling', lambda r: r.rolling(5, stats=['mean', 'max', 'std']), 220, 32),
+    ('curvature', lambda r: Route(r.x, r.y).curvature(), 140, 16),
+    ('split_every', lambda r: r.split_every(50), 100, 80),
+]
+
+
+def _make_route(n):
+    rng = np.random.default_rng(0)
+    x = np.cumsum(rng.normal(size=n))
+    y = np.cumsum(rng.normal(size=n))
+    return Route(x, y, z={'foo':rng.normal(size=n)})
+
+
+@pytest.mark.parametrize('name, fn, peak, retained', BUDGETS, ids=[b[0] for b in BUDGETS])
+def test_memory_budget(name, fn, peak, retained):
+    check_budget(fn, _make_route, SIZES, peak, retained, fixed_bytes=FIXED_BYTES, name=name)
+
+
+def test_smooth_memory_budget():
+    # smooth always outputs 5000 points per channel
+    check_budget(lambda r: r.smooth(), _make_route, SIZES, 300, 1, fixed_bytes=FIXED_BYTES + 5000*8*4, name='smooth')
+
+
+def test_check_budget_report():
+    with pytest.raises(AssertionError) as e:
+        check_budget(lambda r: np.zeros(r.nr_points()*10), _make_route, [1000], 1, name='zeros')
+
+    message = str(e.value)
+    assert 'peak over budget' in message
+    assert 'zeros with 1000 points' in message
+    assert 'memory_test.py' in message
+
+    # the report shows the line of a temporary that caused the peak
+    def temporary(r):
+        tmp = np.zeros(r.nr_points()*100)
+        return float(tmp.sum())
+
+    with pytest.raises(AssertionError) as e:
+        check_budget(temporary, _make_route, [1000], 1, name='temporary')
+
+    message = str(e.value)
+    peak_section = message[message.index('largest allocations at peak'):message.index('largest retained')]
+    assert 'tmp = np.zeros(r.nr_points()*100)' in peak_section
+
+    _, report = measure(temporary, _make_route(1000), trace_peak=True)
+    filename, _, size, _ = report.peak_lines[0]
+    assert filename.endswith('memory_test.py')
+    assert 800000 <= size
+
+    result, report = measure(np.ones, 1000, nr_points=1000)
+    assert report.peak_lines is None
+    assert 1000 == len(result)
+    assert 8000 <= report.retained
+    assert 8 <= report.retained_per_point()
@@ -4,6 +4,7 @@ import numpy as np
 import pandas as pd
 import pytest
 from routely import Route
+from routely.arclength import ArcLength
 
 # with pytest-cov: pytest --cov=routely tests/
 
@@ -305,3 +306,454 @@ def test_rotate():
 
     assert x_exp == list(r2.x)
     assert y_exp == pytest.approx(list(r2.y), rel=0.1)
+
+
+def test_to_from_bytes():
+    x = [0.123456, 5.5, -15.25, 20, 10]
+    y = [0, 10, 40.000004, 10, 5]
+    z = {'foo':[0, 10, 40, -10, 5], 'bar':[1.5, 2.5, 3.5, 4.5, 5.5]}
+    r = Route(x, y, z=z)
+
+    buffer = r.to_bytes(precision=5)
+    r2 = Route.from_bytes(buffer)
+
+    assert isinstance(buffer, bytes)
+    assert r.x == pytest.approx(r2.x, abs=1e-5)
+    assert r.y == pytest.approx(r2.y, abs=1e-5)
+    assert r.d == pytest.approx(r2.d, abs=1e-4)
+    assert list(r.z['foo']) == list(r2.z['foo'])
+    assert r.z['bar'] == pytest.approx(r2.z['bar'])
+
+    # no z data
+    r = Route([0, 1, 2], [3, 4, 5])
+    r2 = Route.from_bytes(r.to_bytes())
+    assert r2.z is None
+    assert list(r.x) == list(r2.x)
+
+    # large values need multi-byte varints
+    x = np.array([0, 2**40, -2**40, 7])
+    r = Route(x, x)
+    assert list(x) == list(Route.from_bytes(r.to_bytes()).x)
+
+    # values or differences outside the int64 range raise instead of wrapping
+    with pytest.raises(ValueError):
+        Route([1e15, 2e15], [0, 1]).to_bytes()
+    with pytest.raises(ValueError):
+        Route(np.array([2**62, -2**62 - 1]), np.array([0, 1])).to_bytes()
+    assert [1e8, 2e8] == list(Route.from_bytes(Route([1e8, 2e8], [0, 1]).to_bytes()).x)
+
+    with pytest.raises(ValueError):
+        Route.from_bytes(b'XXXX' + buffer[4:])
+
+    # truncated anywhere, in the header, names, channel specs or channel data
+    for end in range(len(buffer)):
+        with pytest.raises(ValueError, match='truncated'):
+            Route.from_bytes(buffer[:end])
+
+
+def test_dataframe_views():
+    r = _setup()
+    df = r.dataframe(copy=False)
+
+    assert np.shares_memory(df['x'].to_numpy(), r.x)
+    assert np.shares_memory(df['foo'].to_numpy(), r.z['foo'])
+    assert not np.shares_memory(r.dataframe()['x'].to_numpy(), r.x)
+
+
+def test_from_dataframe():
+    df = pd.DataFrame({
+        'lon':[0., 5., 15., 20., 10.],
+        'lat':[0., 10., 40., 10., 5.],
+        'foo':[0, 10, 40, 10, 5],
+        'bar':[1, 2, 3, 4, 5],
+    })
+    r = Route.from_dataframe(df, x='lon', y='lat', z=['foo'])
+
+    assert list(df['lon']) == list(r.x)
+    assert list(df['foo']) == list(r.z['foo'])
+    assert ['foo'] == list(r.z.keys())
+    assert np.shares_memory(df['lon'].to_numpy(), r.x)
+
+    # round trip, default z uses all other columns
+    r1 = _setup()
+    r2 = Route.from_dataframe(r1.dataframe())
+    assert list(r1.d) == list(r2.d)
+    assert list(r1.z['foo']) == list(r2.z['foo'])
+
+    # no z columns
+    assert Route.from_dataframe(df, x='lon', y='lat', z=[]).z is None
+
+    # other numeric dtypes are converted
+    df32 = df.astype({'lon':np.float32, 'lat':np.float32, 'foo':np.int32})
+    r = Route.from_dataframe(df32, x='lon', y='lat', z=['foo'])
+    assert np.float64 == r.x.dtype
+    assert np.int64 == r.z['foo'].dtype
+    assert list(df['lon']) == list(r.x)
+    assert list(df['foo']) == list(r.z['foo'])
+
+
+def test_to_from_arrow():
+    pytest.importorskip('pyarrow')
+    r1 = _setup()
+    table = r1.to_arrow()
+
+    assert ['x', 'y', 'd', 'foo'] == table.column_names
+
+    r2 = Route.from_arrow(table)
+    assert list(r1.x) == list(r2.x)
+    assert list(r1.d) == list(r2.d)
+    assert list(r1.z['foo']) == list(r2.z['foo'])
+
+    # float32 and int32 columns are converted
+    pa = pytest.importorskip('pyarrow')
+    table = pa.table({'x':pa.array([0, 5, 15], pa.float32()), 'y':pa.array([0, 10, 40], pa.int32())})
+    r2 = Route.from_arrow(table)
+    assert np.float64 == r2.x.dtype
+    assert np.int64 == r2.y.dtype
+    assert [0, 5, 15] == list(r2.x)
+
+
+def test_slice():
+    x = [0, 10, 20, 30, 40]
+    y = [0, 0, 0, 0, 0]
+    z = {'foo':[0, 1, 2, 3, 4]}
+    r = Route(x, y, z=z)
+
+    # end points coincide with coordinates, sections are views
+    r2 = r.slice(10, 30)
+    assert [10, 20, 30] == list(r2.x)
+    assert [0, 10, 20] == list(r2.d)
+    assert np.shares_memory(r2.x, r.x)
+    assert np.shares_memory(r2.z['foo'], r.z['foo'])
+
+    # interpolated end points
+    r2 = r.slice(5, 25)
+    assert [5, 10, 20, 25] == list(r2.x)
+    assert [0.5, 1, 2, 2.5] == list(r2.z['foo'])
+    assert [0, 5, 15, 20] == list(r2.d)
+    assert list(Route(r2.x, r2.y).d) == list(r2.d)
+
+    # distances are clipped to the route
+    assert list(r.x) == list(r.slice(-10, 100).x)
+
+    with pytest.raises(ValueError):
+        r.slice(20, 10)
+
+
+def test_split_every():
+    r = _setup()
+    sections = r.split_every(7)
+
+    assert int(r.d[-1]//7) + 1 == len(sections)
+    for s in sections[:-1]:
+        assert 7 == pytest.approx(s.d[-1])
+        assert list(Route(s.x, s.y).d) == pytest.approx(list(s.d))
+
+    # sections join up to the original route
+    assert (r.x[0], r.y[0]) == (sections[0].x[0], sections[0].y[0])
+    assert (r.x[-1], r.y[-1]) == (sections[-1].x[-1], sections[-1].y[-1])
+    for s1, s2 in zip(sections[:-1], sections[1:]):
+        assert (s1.x[-1], s1.y[-1]) == (s2.x[0], s2.y[0])
+
+    # split points on existing coordinates are not duplicated
+    r = Route([0, 10, 20, 30], [0, 0, 0, 0], z={'foo':[0, 1, 2, 3]})
+    sections = r.split_every(10)
+    assert 3 == len(sections)
+    assert [[0, 10], [10, 20], [20, 30]] == [list(s.x) for s in sections]
+    assert [2, 3] == list(sections[-1].z['foo'])
+
+
+def test_concat():
+    r = _setup()
+    sections = r.split_every(7)
+    r2 = Route.concat(sections)
+
+    assert r.d[-1] == pytest.approx(r2.d[-1])
+
+    r1 = Route([0, 3], [0, 4], z={'foo':[1, 2]})
+    r2 = Route([6, 6], [8, 10], z={'foo':[3, 4]})
+    r3 = Route.concat([r1, r2])
+
+    assert [0, 3, 6, 6] == list(r3.x)
+    assert [1, 2, 3, 4] == list(r3.z['foo'])
+    assert list(Route(r3.x, r3.y).d) == list(r3.d)
+
+    with pytest.raises(ValueError):
+        Route.concat([r1, Route([0, 1], [0, 1])])
+
+
+def test_rolling():
+    rng = np.random.default_rng(0)
+    x = np.cumsum(rng.uniform(0.5, 3, 200))
+    y = np.zeros(200)
+    z = {'foo':rng.normal(size=200)}
+    r = Route(x, y, z=z)
+
+    w = 10
+    r2 = r.rolling(w, stats=['mean', 'sum', 'min', 'max', 'std'])
+
+    # compare against a windowed loop
+    for i in range(len(r.d)):
+        window = z['foo'][(r.d > r.d[i] - w) & (r.d <= r.d[i])]
+        assert window.mean() == pytest.approx(r2.z['foo_mean'][i])
+        assert window.sum() == pytest.approx(r2.z['foo_sum'][i])
+        assert window.min() == r2.z['foo_min'][i]
+        assert window.max() == r2.z['foo_max'][i]
+        if len(window) > 1:
+            assert window.std(ddof=1) == pytest.approx(r2.z['foo_std'][i])
+        else:
+            assert np.isnan(r2.z['foo_std'][i])
+
+    # original z data is kept and x, y, d are unchanged
+    assert list(r.z['foo']) == list(r2.z['foo'])
+    assert list(r.d) == list(r2.d)
+
+    # centered windows
+    r3 = r.rolling(w, stats=['max'], center=True)
+    i = 100
+    window = z['foo'][(r.d >= r.d[i] - w/2) & (r.d <= r.d[i] + w/2)]
+    assert window.max() == r3.z['foo_max'][i]
+
+    with pytest.raises(ValueError):
+        r.rolling(w, stats=['median'])
+
+    with pytest.raises(ValueError):
+        Route([0, 1], [0, 1]).rolling(w)
+
+
+def test_heading_curvature():
+    # square anticlockwise with a repeated point
+    x = [0, 10, 10, 10, 0, 0]
+    y = [0, 0, 0, 10, 10, 0]
+    r = Route(x, y)
+
+    assert [0, 0, 90, -180, -90, -90] == list(r.heading())
+    assert [0, 0, 90, 90, 90, 0] == list(r._turning())
+
+    k = r.curvature()
+    assert np.radians(90)/5 == pytest.approx(k[2])
+    assert np.radians(90)/10 == pytest.approx(k[3])
+    assert 0 == k[0] == k[-1]
+
+    # results are cached
+    assert r.heading() is r.heading()
+
+
+def test_heading_transform_cache():
+    r = _setup()
+    r.heading()
+    r.curvature()
+
+    for r2 in [r.rotate(30), r.mirror(about_x=True), r.mirror(about_y=True), r.mirror(about_x=True, about_y=True)]:
+        cached_heading = r2.heading()
+        cached_curvature = r2.curvature()
+        fresh = Route(r2.x, r2.y)
+
+        assert fresh.heading() == pytest.approx(cached_heading)
+        assert fresh.curvature() == pytest.approx(cached_curvature)
+
+
+def test_heading_copy_cache():
+    r = _setup()
+    heading = r.heading()
+    r.curvature()
+
+    # a copy does not share the cache, so reassigned data gives new results
+    r2 = r.copy()
+    assert '_cached' not in r2.__dict__
+    r2.x, r2.y = r2.y, r2.x
+    r2.d = r2._calculate_distance()
+
+    fresh = Route(r2.x, r2.y)
+    assert fresh.heading() == pytest.approx(r2.heading())
+    assert fresh.curvature() == pytest.approx(r2.curvature())
+    assert r.heading() is heading
+
+
+def test_detect_turns():
+    # right angled left turn then right turn
+    x = [0, 10, 20, 20, 20, 30, 40]
+    y = [0, 0, 0, 10, 20, 20, 20]
+    r = Route(x, y)
+
+    turns = r.detect_turns(min_angle=45)
+    assert [2, 4] == list(turns['index'])
+    assert ['left', 'right'] == list(turns['direction'])
+    assert [90, -90] == list(turns['angle'])
+
+    # adjacent turns in opposite directions, and equally sharp turns in one run
+    assert [1, 2, 3] == list(Route([0, 10, 10, 20, 20], [0, 0, 10, 10, 20]).detect_turns()['index'])
+    assert [1] == list(Route([0, 10, 10, 0], [0, 0, 10, 10]).detect_turns()['index'])
+
+    # gradual turn made of small steps is only detected over a distance
+    t = np.linspace(0, np.pi, 50)
+    r = Route(100*np.cos(t), 100*np.sin(t))
+    assert 0 == len(r.detect_turns(min_angle=45))
+
+    turns = r.detect_turns(min_angle=45, min_distance=100)
+    assert 1 == len(turns)
+    assert 'left' == turns['direction'][0]
+
+
+def test_close_off_route():
+    r = _setup()
+    assert not r.is_closed()
+
+    r2 = r.close_off_route()
+    assert r2.is_closed()
+    assert r.nr_points() + 1 == r2.nr_points()
+    assert r.z['foo'][0] == r2.z['foo'][-1]
+    assert list(Route(r2.x, r2.y).d) == pytest.approx(list(r2.d))
+
+    # already closed
+    assert r2.nr_points() == r2.close_off_route().nr_points()
+
+
+def test_area_centroid():
+    # anticlockwise rectangle, open and closed
+    r = Route([0, 4, 4, 0], [0, 0, 2, 2])
+    assert 8 == r.area()
+    assert 8 == r.area(signed=True)
+    assert 8 == r.close_off_route().area()
+    assert (2, 1) == r.centroid()
+
+    # clockwise L shape, centroid differs from the bbox center
+    x = [0, 0, 1, 1, 3, 3]
+    y = [0, 3, 3, 1, 1, 0]
+    r = Route(x, y)
+    assert -5 == r.area(signed=True)
+    cx, cy = r.centroid()
+    assert (1.1, 1.1) == (pytest.approx(cx), pytest.approx(cy))
+    assert r.center() != r.centroid()
+
+    with pytest.raises(ValueError):
+        Route([0, 1, 2], [0, 1, 2]).centroid()
+
+
+def test_contains():
+    # L shape
+    x = [0, 0, 1, 1, 3, 3]
+    y = [0, 3, 3, 1, 1, 0]
+    r = Route(x, y)
+
+    points = [(0.5, 0.5), (0.5, 2.5), (2.5, 0.5), (2, 2), (-1, 0.5), (4, 0.5), (0.5, 4)]
+    assert [True, True, True, False, False, False, False] == list(r.contains(points))
+
+    # compare against a brute force crossing number test
+    t = np.linspace(0, 2*np.pi, 200, endpoint=False)
+    radius = 10 + 3*np.sin(5*t)
+    r = Route(radius*np.cos(t), radius*np.sin(t))
+    pts = np.random.default_rng(0).uniform(-15, 15, (2000, 2))
+
+    x1, y1 = r.x, r.y
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    px, py = pts[:, :1], pts[:, 1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crosses = ((y1 > py) != (y2 > py)) & (px < x1 + (py - y1)*(x2 - x1)/(y2 - y1))
+    expected = crosses.sum(axis=1) % 2 == 1
+
+    assert list(expected) == list(r.contains(pts, chunk_size=300))
+
+    # a comb of tall teeth keeps the edge index linear in the number of edges
+    n = 2000
+    teeth_x = np.repeat(np.arange(n, dtype=float), 2)
+    x = np.r_[teeth_x, n, n, -1, -1]
+    y = np.r_[np.tile([0., 100.], n), 100, -1, -1, 100]
+    r = Route(x, y)
+    assert len(r._edge_bands()['edges']) <= 4*len(x)
+
+    pts = [(0.5, 50), (1, 50.5), (n - 0.5, 101), (-2, 50)]
+    x1, y1 = r.x, r.y
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    px, py = np.array(pts)[:, :1], np.array(pts)[:, 1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crosses = ((y1 > py) != (y2 > py)) & (px < x1 + (py - y1)*(x2 - x1)/(y2 - y1))
+    assert list(crosses.sum(axis=1) % 2 == 1) == list(r.contains(pts))
+
+
+def test_build_lod(tmp_path):
+    t = np.linspace(0, 4*np.pi, 500)
+    r = Route(100*np.cos(t) + t, 100*np.sin(t), z={'foo':np.arange(500)})
+    lod = r.build_lod(levels=6, min_tolerance=0.1)
+
+    assert lod is r.build_lod(levels=6, min_tolerance=0.1)
+    assert 6 == lod.nr_levels()
+    assert [0, 0.1, 0.2, 0.4, 0.8, 1.6] == pytest.approx(list(lod.tolerances()))
+
+    # levels are nested and keep the end points
+    sizes = [len(idx) for idx in lod.indexes]
+    assert sizes == sorted(sizes, reverse=True)
+    for coarse, fine in zip(lod.indexes[1:], lod.indexes[:-1]):
+        assert set(coarse) <= set(fine)
+        assert coarse[0] == 0 and coarse[-1] == 499
+
+    # level selection
+    assert 0 == lod.level_for(0.05)
+    assert 1 == lod.level_for(0.1)
+    assert 3 == lod.level_for(0.5)
+    assert 5 == lod.level_for(pixel_size=100)
+    assert lod.get(0) is r
+
+    # simplified routes are cached and stay within tolerance of the original points
+    r2 = lod.get(0.5)
+    assert r2 is lod.get(0.7)
+    assert list(r.z['foo'][lod.indexes[3]]) == list(r2.z['foo'])
+    assert list(Route(r2.x, r2.y).d) == pytest.approx(list(r2.d))
+
+    path = str(tmp_path / 'lod.npz')
+    lod.save(path)
+    lod2 = type(lod).load(path, r)
+    assert all((a == b).all() for a, b in zip(lod.indexes, lod2.indexes))
+    assert lod.tolerances() == pytest.approx(lod2.tolerances())
+
+
+def test_mirror():
+    r = _setup()
+
+    r2 = r.mirror(about_y=True)
+    assert [20, 15, 5, 0, 10] == list(r2.x)
+    assert list(r.y) == list(r2.y)
+
+    r2 = r.mirror(about_x=True, about_axis=True)
+    assert list(r.x) == list(r2.x)
+    assert [0, -10, -40, -10, -5] == list(r2.y)
+
+
+def test_map_threaded():
+    routes = [_setup().rotate(a) for a in range(0, 90, 10)]
+
+    output = Route.map_threaded('interpolate', routes, workers=4, num=2)
+    expected = [r.interpolate(num=2) for r in routes]
+    assert [list(r.x) for r in expected] == [list(r.x) for r in output]
+
+    output = Route.map_threaded(lambda r, w: r.width()*w, routes, workers=4, w=2)
+    assert [r.width()*2 for r in routes] == output
+
+
+def test_smooth():
+    r = _setup()
+    r2 = r.smooth()
+
+    # passes through the start and end coords
+    assert (r.x[0], r.y[0]) == pytest.approx((r2.x[0], r2.y[0]))
+    assert (r.x[-1], r.y[-1]) == pytest.approx((r2.x[-1], r2.y[-1]))
+    assert 5000 == r2.nr_points()
+    assert 5000 == len(r2.z['foo'])
+
+    # by default points are spaced along the distance of the fitted points
+    r4 = r.smooth(num=200)
+    curve = ArcLength(r.d, r.x, r.y)
+    assert np.allclose(curve.fx(np.linspace(0, r.d[-1], 200)), r4.x)
+
+    # with arc_length, points are equally spaced along the curve, so chords are equal up to curvature
+    steps = np.diff(r.smooth(num=200, arc_length=True).d)
+    assert steps.max() - steps.min() < 0.01*steps.max()
+
+    # points are at exact arc length steps along the fitted curve, chords are no longer than the steps
+    r3 = r.smooth(spacing=2.)
+    t = curve.resample(spacing=2.)
+    assert np.allclose(curve.fx(t), r3.x)
+    assert np.allclose(curve.fy(t), r3.y)
+    assert np.allclose(np.diff(curve.s(t))[:-1], 2.)
+    assert np.all(np.diff(r3.d) <= 2.)
+    assert (r.x[-1], r.y[-1]) == pytest.approx((r3.x[-1], r3.y[-1]))